@@ -0,0 +1,451 @@
+import cv2
+import numpy as np
+import argparse
+import json
+import platform
+import os
+import sys
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import itertools
+import threading
+import http.client
+
+import qr_code_scanner as scanner
+
+# One sample payload for every QR code type the scanner handles
+SAMPLE_PAYLOADS = {
+    'wifi': "WIFI:T:WPA;S:Office Guest;P:correct horse battery;;",
+    'contact': "BEGIN:VCARD\nVERSION:3.0\nFN:Jane Doe\nTEL;TYPE=cell:+15550100\nEMAIL:jane@example.com\nEND:VCARD",
+    'event': "BEGIN:VEVENT\nSUMMARY:Product Launch\nDTSTART:20250301T090000Z\nDTEND:20250301T100000Z\nEND:VEVENT",
+    'email': "mailto:hello@example.com?subject=Hello&body=Hi there",
+    'sms': "smsto:+15550100:See you soon",
+    'geo': "geo:37.7749,-122.4194",
+    'social': "https://www.instagram.com/example",
+    'link': "https://example.com/products/42?ref=qr",
+}
+
+FRAME_SIZE = (1280, 720)
+
+def parse_args(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(description="Offline benchmark of QR decoding on synthetic scenes")
+    parser.add_argument("--decoders", default=','.join(sorted(scanner.DECODER_BACKENDS)),
+                        help="Comma separated decoder backends to benchmark")
+    parser.add_argument("--modes", default="full,roi,pyramid",
+                        help="Comma separated decode modes: full, roi, pyramid, consensus")
+    parser.add_argument("--sizes", default="100,200,360", help="QR code sizes in pixels")
+    parser.add_argument("--rotations", default="0,20", help="Rotation angles in degrees")
+    parser.add_argument("--blurs", default="0,5", help="Gaussian blur kernel sizes, 0 for none")
+    parser.add_argument("--noises", default="0,12", help="Gaussian noise standard deviations")
+    parser.add_argument("--contrasts", default="1",
+                        help="Scene contrast factors, below 1 for dim, low-light scenes (e.g. 1,0.3)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Frames per scene, with the code jittering slightly as if held by hand")
+    parser.add_argument("--quick", action="store_true",
+                        help="One 200px, unrotated, clean scene per payload type")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for scene generation")
+    parser.add_argument("--hand-trace", metavar="FILE",
+                        help="JSON list of normalized [x, y] index finger positions (or null) replayed per frame")
+    parser.add_argument("--output", default="benchmark_report.json", help="Report file")
+    parser.add_argument("--compare", metavar="BASELINE",
+                        help="Compare with an earlier report and exit with status 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+                        help="Allowed relative slowdown before a result counts as a regression (default: 0.1)")
+    parser.add_argument("--service", type=int, metavar="PORT",
+                        help="Measure a decode service started with --serve PORT instead of the decoders")
+    parser.add_argument("--clients", type=int, default=8,
+                        help="With --service, number of concurrent clients (default: 8)")
+    parser.add_argument("--requests", type=int, default=25,
+                        help="With --service, requests sent by each client (default: 25)")
+    parser.add_argument("--actions", type=int, metavar="RUNS",
+                        help="Measure the Wi-Fi, contact and event actions instead, RUNS times each, "
+                             "with the Linux handlers and the commands given by --nmcli and --opener")
+    parser.add_argument("--nmcli", default="nmcli", help="With --actions, command used in place of nmcli")
+    parser.add_argument("--opener", default="xdg-open", help="With --actions, command used in place of xdg-open")
+    parser.add_argument("--startup", type=int, metavar="RUNS",
+                        help="Measure scanner startup instead: RUNS cold starts per decoder replaying a short recording")
+    return parser.parse_args(argv)
+
+def parse_list(value, cast):
+    return [cast(part) for part in value.split(',') if part.strip()]
+
+def render_qr(payload, size):
+    """
+    Black on white QR code with a quiet zone, scaled to roughly size pixels
+    """
+    code = cv2.QRCodeEncoder.create().encode(payload)
+    code = cv2.resize(code, (size, size), interpolation=cv2.INTER_NEAREST)
+    border = max(size // 8, 4)
+    return cv2.copyMakeBorder(code, border, border, border, border, cv2.BORDER_CONSTANT, value=255)
+
+def make_scene(code, rotation, blur, noise, offset, rng, contrast=1.0):
+    """
+    Place a QR code on a textured background as a camera would see it
+    """
+    width, height = FRAME_SIZE
+    background = rng.integers(90, 200, size=(height // 16, width // 16, 3), dtype=np.uint8)
+    frame = cv2.resize(background, FRAME_SIZE, interpolation=cv2.INTER_LINEAR)
+
+    code = cv2.cvtColor(code, cv2.COLOR_GRAY2BGR)
+    if rotation:
+        h, w = code.shape[:2]
+        side = int(np.ceil(np.hypot(h, w)))
+        matrix = cv2.getRotationMatrix2D((w / 2, h / 2), rotation, 1.0)
+        matrix[0, 2] += (side - w) / 2
+        matrix[1, 2] += (side - h) / 2
+        mask = cv2.warpAffine(np.full((h, w), 255, np.uint8), matrix, (side, side))
+        code = cv2.warpAffine(code, matrix, (side, side), borderValue=(255, 255, 255))
+    else:
+        mask = np.full(code.shape[:2], 255, np.uint8)
+
+    h, w = code.shape[:2]
+    x = min(max(offset[0], 0), width - w)
+    y = min(max(offset[1], 0), height - h)
+    region = frame[y:y + h, x:x + w]
+    region[mask > 0] = code[mask > 0]
+
+    if contrast != 1:
+        # Dim scene: little contrast left, and the sensor noise below counts for more
+        frame = cv2.convertScaleAbs(frame, alpha=contrast, beta=10)
+    if blur:
+        frame = cv2.GaussianBlur(frame, (blur | 1, blur | 1), 0)
+    if noise:
+        frame = np.clip(frame + rng.normal(0, noise, frame.shape), 0, 255).astype(np.uint8)
+    return frame
+
+def scene_specs(args):
+    if args.quick:
+        sizes, rotations, blurs, noises, contrasts = [200], [0], [0], [0], [1.0]
+    else:
+        sizes = parse_list(args.sizes, int)
+        rotations = parse_list(args.rotations, float)
+        blurs = parse_list(args.blurs, int)
+        noises = parse_list(args.noises, float)
+        contrasts = parse_list(args.contrasts, float)
+    return [
+        {'payload': payload_type, 'size': size, 'rotation': rotation, 'blur': blur, 'noise': noise,
+         'contrast': contrast}
+        for payload_type, size, rotation, blur, noise, contrast
+        in itertools.product(sorted(SAMPLE_PAYLOADS), sizes, rotations, blurs, noises, contrasts)
+    ]
+
+def generate_frames(specs, repeat, seed):
+    """
+    Yield (spec, frame) for every scene, the same sequence for the same seed
+    """
+    rng = np.random.default_rng(seed)
+    width, height = FRAME_SIZE
+    for spec in specs:
+        code = render_qr(SAMPLE_PAYLOADS[spec['payload']], spec['size'])
+        x = int(rng.integers(0, max(width - code.shape[1] * 1.5, 1)))
+        y = int(rng.integers(0, max(height - code.shape[0] * 1.5, 1)))
+        for _ in range(repeat):
+            # Small hand tremor between frames
+            x += int(rng.integers(-4, 5))
+            y += int(rng.integers(-4, 5))
+            yield spec, make_scene(code, spec['rotation'], spec['blur'], spec['noise'], (x, y), rng,
+                                   spec['contrast'])
+
+def build_decoder(backend_name, mode):
+    backend = scanner.create_backend(backend_name)
+    if mode == 'roi':
+        return scanner.TrackingDecoder(decode_fn=backend.decode).decode
+    elif mode == 'pyramid':
+        return scanner.PyramidDecoder(decode_fn=backend.decode, scales=(0.25, 0.5, 1.0)).decode
+    elif mode == 'consensus':
+        return scanner.ConsensusDecoder(decode_fn=backend.decode, enhance='clahe').decode
+    return backend.decode
+
+def process_frame(frame, decode_fn, fingertip, code_tracker, overlay, now):
+    """
+    The per-frame work of the scanner's main loop, with hand tracking replaced by a replayed fingertip
+    """
+    start = time.perf_counter()
+    decoded_objects = scanner.mirror_decoded(decode_fn(frame), frame.shape[1])
+    decode_seconds = time.perf_counter() - start
+    frame = cv2.flip(frame, 1)
+    for obj in decoded_objects:
+        pts = [(pt.x, pt.y) for pt in obj.polygon]
+        for i in range(len(pts)):
+            cv2.line(frame, pts[i], pts[(i+1)%len(pts)], (0,255,0), 3)
+
+    code_tracker.update(decoded_objects, now)
+    button_list = code_tracker.buttons()
+    button_index = scanner.SpatialGrid()
+    for button in button_list:
+        button_index.insert(button[1], button)
+
+    pressed = None
+    if fingertip is not None:
+        h, w = frame.shape[:2]
+        index_x, index_y = int(fingertip[0] * w), int(fingertip[1] * h)
+        cv2.circle(frame, (index_x, index_y), 10, (255, 0, 0), cv2.FILLED)
+        pressed = button_index.query_point(index_x, index_y)
+    status_lines = []
+    for track in code_tracker.tracks.values():
+        if track.payload and track.slot is not None:
+            x1, _, _, y2 = scanner.slot_rect(track.slot)
+            status_lines.append((scanner.describe_payload(track.payload), (x1, y2 + 50), (255, 255, 255)))
+    overlay.update(frame.shape, button_list, (pressed[2], pressed[0]) if pressed else None, status_lines)
+    overlay.draw(frame)
+    return [obj.data for obj in decoded_objects], decode_seconds
+
+def run_config(backend_name, mode, specs, args, hand_trace):
+    decode_fn = build_decoder(backend_name, mode)
+    code_tracker = scanner.CodeTracker()
+    overlay = scanner.OverlayLayer()
+    latencies = []
+    decode_time = 0.0
+    hits = {}
+    totals = {}
+    for index, (spec, frame) in enumerate(generate_frames(specs, args.repeat, args.seed)):
+        fingertip = hand_trace[index % len(hand_trace)] if hand_trace else None
+        start = time.perf_counter()
+        decoded_data, decode_seconds = process_frame(frame, decode_fn, fingertip, code_tracker, overlay, index / 30)
+        latencies.append(time.perf_counter() - start)
+        decode_time += decode_seconds
+        payload_type = spec['payload']
+        totals[payload_type] = totals.get(payload_type, 0) + 1
+        if SAMPLE_PAYLOADS[payload_type].encode('utf-8') in decoded_data:
+            hits[payload_type] = hits.get(payload_type, 0) + 1
+
+    # Separate, shorter pass for memory so tracing doesn't distort the timings
+    decode_fn = build_decoder(backend_name, mode)
+    code_tracker = scanner.CodeTracker()
+    overlay = scanner.OverlayLayer()
+    tracemalloc.start()
+    frames = itertools.islice(generate_frames(specs, args.repeat, args.seed), 50)
+    for index, (_, frame) in enumerate(frames):
+        tracemalloc.reset_peak()
+        process_frame(frame, decode_fn, None, code_tracker, overlay, index / 30)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    frames = len(latencies)
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+    return {
+        'config': f"{backend_name}+{mode}",
+        'decoder': backend_name,
+        'mode': mode,
+        'frames': frames,
+        'frames_per_second': frames / sum(latencies),
+        'decodes_per_second': frames / decode_time if decode_time else 0.0,
+        'detections_per_decode_second': sum(hits.values()) / decode_time if decode_time else 0.0,
+        'detection_rate': sum(hits.values()) / frames,
+        'detection_rate_by_type': {payload_type: hits.get(payload_type, 0) / totals[payload_type]
+                                   for payload_type in sorted(totals)},
+        'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99},
+        'peak_memory_mb': peak / 2**20,
+    }
+
+def run_service_benchmark(args):
+    """
+    Post every scene as a PNG to a running decode service from concurrent keep-alive clients
+    """
+    images = [(spec, cv2.imencode('.png', frame)[1].tobytes())
+              for spec, frame in generate_frames(scene_specs(args), 1, args.seed)]
+    latencies = []
+    statuses = {}
+    hits = [0]
+    lock = threading.Lock()
+
+    def client(index):
+        connection = http.client.HTTPConnection('127.0.0.1', args.service, timeout=60)
+        for request in range(args.requests):
+            spec, image = images[(index * args.requests + request) % len(images)]
+            start = time.perf_counter()
+            connection.request('POST', '/decode', body=image, headers={'Content-Type': 'image/png'})
+            response = connection.getresponse()
+            body = response.read()
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+                if response.status == 200 and any(code['data'] == SAMPLE_PAYLOADS[spec['payload']]
+                                                   for code in json.loads(body)['codes']):
+                    hits[0] += 1
+        connection.close()
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(args.clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+    return {
+        'clients': args.clients,
+        'requests': len(latencies),
+        'requests_per_second': len(latencies) / elapsed,
+        'statuses': {str(status): count for status, count in sorted(statuses.items())},
+        'detection_rate': hits[0] / len(latencies),
+        'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99},
+    }
+
+def run_startup_benchmark(args):
+    """
+    Start the scanner repeatedly on a short recording and take the median time to each startup milestone
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        # A few empty frames, as a camera shows before a code is held up, then a code
+        recording = os.path.join(directory, 'startup.rec')
+        recorder = scanner.FrameRecorder(recording)
+        rng = np.random.default_rng(args.seed)
+        code = render_qr(SAMPLE_PAYLOADS['link'], 200)
+        empty = make_scene(code, 0, 0, 0, (0, 0), rng)
+        empty[:] = 128
+        for frame in [empty] * 5 + [make_scene(code, 0, 0, 0, (540, 260), rng)] * 10:
+            recorder.write_frame(frame)
+            recorder.annotate([], None)
+        recorder.close()
+
+        report_path = os.path.join(directory, 'startup.json')
+        for backend_name in parse_list(args.decoders, str):
+            runs = []
+            for _ in range(args.startup):
+                start = time.perf_counter()
+                subprocess.run(
+                    [sys.executable, scanner.__file__, '--serial', '--no-window', '--decoder', backend_name,
+                     '--replay', recording, '--replay-speed', 'max', '--startup-report', report_path],
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+                with open(report_path, encoding='utf-8') as file:
+                    milestones = json.load(file)
+                milestones['total'] = time.perf_counter() - start
+                runs.append(milestones)
+            names = [name for name in runs[0] if all(name in run for run in runs)]
+            results.append({
+                'decoder': backend_name,
+                'runs': len(runs),
+                'median_seconds': {name: float(np.median([run[name] for run in runs])) for name in names},
+            })
+    return results
+
+def run_action_benchmark(args):
+    """
+    Run the command based actions through perform_action against stand-in commands
+    """
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        platform_actions = scanner.LinuxActions(temp_dir=directory, nmcli=args.nmcli, opener=args.opener)
+        for action, payload_type in (('Connect to Wi-Fi', 'wifi'), ('Save Contact', 'contact'),
+                                     ('Save Event', 'event')):
+            payload = scanner.parse_payload(SAMPLE_PAYLOADS[payload_type])
+            latencies = []
+            for _ in range(args.actions):
+                start = time.perf_counter()
+                message = scanner.perform_action(action, payload, platform_actions)
+                latencies.append(time.perf_counter() - start)
+            p50, p95, p99 = np.percentile(latencies, (50, 95, 99)) * 1000
+            results.append({
+                'action': action,
+                'runs': len(latencies),
+                'message': message,
+                'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99},
+            })
+    return results
+
+def compare_reports(report, baseline, tolerance):
+    """
+    List results that got slower, less reliable or hungrier than the baseline
+    """
+    regressions = []
+    previous = {result['config']: result for result in baseline['results']}
+    for result in report['results']:
+        old = previous.get(result['config'])
+        if old is None:
+            continue
+        name = result['config']
+        if result['frames_per_second'] < old['frames_per_second'] * (1 - tolerance):
+            regressions.append(f"{name}: {result['frames_per_second']:.1f} fps, was {old['frames_per_second']:.1f}")
+        if result['latency_ms']['p95'] > old['latency_ms']['p95'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['latency_ms']['p95']:.1f} ms, was {old['latency_ms']['p95']:.1f}")
+        if result['detection_rate'] < old['detection_rate'] - 0.02:
+            regressions.append(f"{name}: detection {result['detection_rate']:.1%}, was {old['detection_rate']:.1%}")
+        if result['peak_memory_mb'] > old['peak_memory_mb'] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: peak memory {result['peak_memory_mb']:.1f} MB, was {old['peak_memory_mb']:.1f}")
+    return regressions
+
+def main(argv=None):
+    args = parse_args(argv)
+    for payload_type, payload in SAMPLE_PAYLOADS.items():
+        assert scanner.parse_payload(payload).type == payload_type, payload_type
+
+    hand_trace = None
+    if args.hand_trace:
+        with open(args.hand_trace, encoding='utf-8') as file:
+            hand_trace = json.load(file)
+
+    if args.service:
+        result = run_service_benchmark(args)
+        print(f"service x{result['clients']:<3} {result['requests_per_second']:7.1f} req/s  "
+              f"p50 {result['latency_ms']['p50']:6.1f} ms  p95 {result['latency_ms']['p95']:6.1f} ms  "
+              f"detected {result['detection_rate']:6.1%}  statuses {result['statuses']}")
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'service': result}, file, indent=2)
+        print(f"Report written to {args.output}")
+        return
+
+    if args.actions:
+        results = run_action_benchmark(args)
+        for result in results:
+            print(f"{result['action']:<18} p50 {result['latency_ms']['p50']:6.1f} ms  "
+                  f"p95 {result['latency_ms']['p95']:6.1f} ms  {result['message']}")
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'actions': results}, file, indent=2)
+        print(f"Report written to {args.output}")
+        return
+
+    if args.startup:
+        results = run_startup_benchmark(args)
+        for result in results:
+            print(f"{result['decoder']:<14} " + "  ".join(
+                f"{name.replace('_', ' ')} {seconds * 1000:6.0f} ms" for name, seconds in result['median_seconds'].items()))
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump({'startup': results}, file, indent=2)
+        print(f"Report written to {args.output}")
+        return
+
+    specs = scene_specs(args)
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'machine': platform.machine(),
+            'seed': args.seed,
+            'scenes': len(specs),
+            'repeat': args.repeat,
+            'hand_trace': args.hand_trace,
+        },
+        'results': [],
+    }
+    for backend_name in parse_list(args.decoders, str):
+        for mode in parse_list(args.modes, str):
+            result = run_config(backend_name, mode, specs, args, hand_trace)
+            report['results'].append(result)
+            print(f"{result['config']:<22} {result['frames_per_second']:7.1f} fps  "
+                  f"p50 {result['latency_ms']['p50']:6.1f} ms  p95 {result['latency_ms']['p95']:6.1f} ms  "
+                  f"detected {result['detection_rate']:6.1%}  peak {result['peak_memory_mb']:6.1f} MB")
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as file:
+            baseline = json.load(file)
+        regressions = compare_reports(report, baseline, args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
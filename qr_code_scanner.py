@@ -1,245 +1,2712 @@
+import time
+STARTUP_START = time.perf_counter()  # Before the imports below, for the startup report
 import cv2
-from pyzbar.pyzbar import decode
-import mediapipe as mp
-import webbrowser
+import numpy as np
 import platform
 import subprocess
 import os
 import sys
-import time
-import pyperclip
 import tempfile
+import shutil
+import argparse
+import threading
+from collections import Counter, OrderedDict, deque, namedtuple
+from concurrent.futures import BrokenExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlsplit
+from functools import lru_cache
+from types import MappingProxyType
+import re
+import json
+import struct
+import base64
+import signal
+import math
+import queue
+import gc
+from http import HTTPStatus
+import functools
+import hashlib
+
+def parse_args(argv=None):
+    """
+    Parse command line options
+    """
+    parser = argparse.ArgumentParser(description="Interactive QR code scanner with hand gesture control")
+    parser.add_argument(
+        "--serial", action="store_true",
+        help="Capture, decode and track hands one after another on a single thread")
+    parser.add_argument(
+        "--decoder", choices=sorted(DECODER_BACKENDS) + ['auto'], default='pyzbar',
+        help="QR decoder backend; 'auto' times every backend on the first frames and keeps the fastest reliable one")
+    parser.add_argument(
+        "--roi", action="store_true",
+        help="Decode only around the last known QR code position, with periodic full frame scans")
+    parser.add_argument(
+        "--full-scan-interval", type=parse_positive_int, default=30, metavar="N",
+        help="With --roi, scan the full frame at least every N frames (default: 30)")
+    parser.add_argument(
+        "--roi-padding", type=float, default=0.5, metavar="RATIO",
+        help="With --roi, pad the region by this fraction of the code size (default: 0.5)")
+    parser.add_argument(
+        "--scales", type=parse_scales, metavar="S1,S2,...",
+        help="Decode on downscaled grayscale images first, e.g. 0.25,0.5,1.0, moving to the next scale only when nothing is found")
+    parser.add_argument(
+        "--consensus", action="store_true",
+        help="Combine decodes over the last frames, voting on each code's payload and keeping it through short misses")
+    parser.add_argument(
+        "--consensus-window", type=parse_positive_int, default=5, metavar="N",
+        help="With --consensus, number of frames each code's votes are kept for (default: 5)")
+    parser.add_argument(
+        "--enhance", choices=['clahe', 'threshold'],
+        help="With --consensus, retry the region of a code missed on several frames with CLAHE or adaptive thresholding")
+    parser.add_argument(
+        "--motion-threshold", type=float, metavar="T",
+        help="Reuse the previous decode and hand tracking results while the mean pixel change stays below T (0-255), e.g. 3")
+    parser.add_argument(
+        "--hand-scale", type=float, default=1.0, metavar="S",
+        help="Downscale frames by S before hand tracking (default: 1.0)")
+    parser.add_argument(
+        "--hand-interval", type=parse_positive_int, default=1, metavar="N",
+        help="Run hand tracking on every Nth frame only (default: 1)")
+    parser.add_argument(
+        "--frame-budget", type=float, metavar="MS",
+        help="Adapt how often and at what resolution frames are decoded, and how often hands are tracked, "
+             "to keep each frame within MS milliseconds, e.g. 33; overrides --hand-interval")
+    parser.add_argument(
+        "--batch", metavar="PATH",
+        help="Scan an image, a video file or a directory of them without a camera or window, writing JSON lines")
+    parser.add_argument(
+        "--sources", type=parse_sources, metavar="SRC1,SRC2,...",
+        help="Scan several camera indices or video files at once, one process per source, writing JSON lines")
+    parser.add_argument(
+        "--preview", action="store_true",
+        help="With --sources, show every source's newest frame in one tiled window")
+    parser.add_argument(
+        "--serve", type=int, metavar="PORT",
+        help="Decode uploaded images on http://127.0.0.1:PORT/decode and a WebSocket stream on /stream")
+    parser.add_argument(
+        "--serve-queue", type=parse_positive_int, default=64, metavar="N",
+        help="With --serve, reject requests with 503 once N are waiting (default: 64)")
+    parser.add_argument(
+        "--serve-batch", type=parse_positive_int, default=8, metavar="N",
+        help="With --serve, hand up to N waiting images to a worker at once (default: 8)")
+    parser.add_argument(
+        "--output", metavar="FILE",
+        help="With --batch or --sources, write results to FILE instead of standard output")
+    parser.add_argument(
+        "--workers", type=parse_positive_int, metavar="N",
+        help="With --batch or --serve, number of worker processes (default: number of CPUs)")
+    parser.add_argument(
+        "--frame-step", type=parse_positive_int, default=1, metavar="N",
+        help="With --batch, scan every Nth video frame (default: 1)")
+    parser.add_argument(
+        "--hud", action="store_true",
+        help="Show FPS and p50/p95/p99 latency of every stage on screen")
+    parser.add_argument(
+        "--perf-export", metavar="FILE",
+        help="Write stage latencies to FILE every few seconds, as Prometheus text for .prom files and JSON otherwise")
+    parser.add_argument(
+        "--perf-port", type=int, metavar="PORT",
+        help="Serve stage latencies on http://127.0.0.1:PORT/metrics (Prometheus) and /metrics.json")
+    parser.add_argument(
+        "--no-window", action="store_true",
+        help="Scan without showing a window, stopping at the end of a replay or on Ctrl+C")
+    parser.add_argument(
+        "--startup-report", metavar="FILE",
+        help="Write the startup timings (imports, camera, decoder, first frame, first decode) to FILE as JSON on exit")
+    parser.add_argument(
+        "--alloc-report", action="store_true",
+        help="Trace memory allocations and garbage collections per frame and print a summary on exit")
+    parser.add_argument(
+        "--history", metavar="FILE",
+        help="Log scanned codes to the SQLite database FILE, or query it with --recent and --top")
+    parser.add_argument(
+        "--history-ttl", type=float, default=60, metavar="SECONDS",
+        help="With --history, log a code seen again only after SECONDS since it was last logged (default: 60)")
+    parser.add_argument(
+        "--recent", type=parse_positive_int, metavar="N",
+        help="With --history, print the N most recent scans and exit")
+    parser.add_argument(
+        "--top", type=parse_positive_int, metavar="N",
+        help="With --history, print the N most frequently scanned codes and exit")
+    parser.add_argument(
+        "--type", choices=sorted(PAYLOAD_BUTTONS),
+        help="With --recent or --top, only show codes of this payload type")
+    parser.add_argument(
+        "--record", metavar="FILE",
+        help="Record raw camera frames to FILE, with decode results and hand landmarks in FILE.jsonl")
+    parser.add_argument(
+        "--replay", metavar="FILE",
+        help="Replay a recording instead of using the webcam")
+    parser.add_argument(
+        "--replay-speed", choices=['native', 'max'], default='native',
+        help="Replay at the recorded frame rate or as fast as possible, which implies --serial (default: native)")
+    parser.add_argument(
+        "--replay-landmarks", action="store_true",
+        help="With --replay, use the recorded hand landmarks instead of running Mediapipe")
+    args = parser.parse_args(argv)
+    if not args.history and (args.recent is not None or args.top is not None or args.type):
+        parser.error("--recent, --top and --type need --history FILE")
+    return args
+
+def parse_positive_int(value):
+    """
+    Parse a count that must be at least 1
+    """
+    try:
+        number = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid int value: {value}")
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1: {value}")
+    return number
+
+def parse_scales(value):
+    """
+    Parse a comma separated scale ladder such as 0.25,0.5,1.0
+    """
+    try:
+        scales = [float(part) for part in value.split(',') if part.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid scale list: {value}")
+    if not scales or any(not 0 < scale <= 1 for scale in scales):
+        raise argparse.ArgumentTypeError("scales must be between 0 and 1")
+    return scales
+
+def parse_sources(value):
+    """
+    Parse a comma separated list of camera indices and video files
+    """
+    sources = [int(part) if part.isdigit() else part
+               for part in (part.strip() for part in value.split(',')) if part]
+    if not sources:
+        raise argparse.ArgumentTypeError("no sources given")
+    return sources
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.history and (args.recent is not None or args.top is not None):
+        query_history(args)
+        return
+    if args.batch:
+        run_batch(args)
+        return
+    if args.sources:
+        run_sources(args)
+        return
+    if args.serve:
+        run_service(args)
+        return
+    startup = StartupTimer(STARTUP_START)
+    startup.mark('imports')
+    if args.replay and args.replay_speed == 'max' and not args.serial:
+        # The threaded pipeline only processes the newest frame, and a replay as fast as possible would skip nearly all
+        print("Replaying at max speed in serial mode, so every frame is decoded and compared")
+        args.serial = True
+
+    # Build the QR decoder, importing its modules, while the camera starts up
+    # Decode resolution is lowered beneath the rest of the decoder chain when the frame budget asks for it
+    scaler = ScaledDecoder() if args.frame_budget else None
+    loader = ThreadPoolExecutor(max_workers=1)
+    decoder_future = loader.submit(create_decoder, args, scaler)
+    loader.shutdown(wait=False)
+
+    # Start video capture, or replay a recording
+    replay = None
+    if args.replay:
+        replay = ReplaySource(args.replay, realtime=args.replay_speed == 'native')
+        cap = replay
+    else:
+        cap = cv2.VideoCapture(0)
+    if not cap.isOpened():
+        print("Cannot open webcam")
+        sys.exit(1)
+    
+    # Set window size
+    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
+    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
+    startup.mark('camera')
+
+    recorder = None
+    if args.record:
+        recorder = FrameRecorder(args.record)
+        cap = RecordingSource(cap, recorder)
+    
+    # Stage latency measurements, a no-op unless requested
+    perf = NULL_TIMINGS
+    metrics_server = None
+    if args.hud or args.perf_export or args.perf_port:
+        perf = StageTimings()
+    if args.perf_port:
+        metrics_server = serve_metrics(perf, args.perf_port)
+    last_export_time = time.time()
+    alloc_report = AllocationReport() if args.alloc_report else None
+
+    # Scan log, written in the background
+    history = ScanHistory(args.history, ttl=args.history_ttl) if args.history else None
+
+    # Mediapipe Hand Tracking, loaded in the background once the first frame is on screen
+    if replay is not None and args.replay_landmarks:
+        hand_tracker = ReplayHandTracker(replay)
+    else:
+        hand_tracker = HandTracker(scale=args.hand_scale, interval=args.hand_interval, perf=perf, startup=startup)
+
+    # QR code decoder
+    decode_fn, pyramid = decoder_future.result()
+    startup.mark('decoder')
+
+    # Decode and hand tracking rates adapted to the frame budget
+    scheduler = None
+    track_hands = hand_tracker.process
+    if args.frame_budget:
+        scheduler = FrameScheduler(decode_fn, scaler, hand_tracker, args.frame_budget / 1000, serial=args.serial)
+        decode_fn = scheduler.decode
+        track_hands = scheduler.track_hands
+    hud = PerformanceHUD(perf, scheduler) if args.hud else None
+
+    # Run capture, decoding and hand tracking on their own threads unless serial mode is requested
+    pipeline = None
+    if not args.serial:
+        pipeline = FramePipeline(
+            cap, track_hands, decode_fn, motion_threshold=args.motion_threshold, perf=perf)
+        pipeline.start()
+    motion = None
+    if pipeline is None and args.motion_threshold is not None:
+        motion = MotionDetector(args.motion_threshold)
+    
+    # Variables
+    button_list = []  # (text, rect, track id)
+    button_index = SpatialGrid()
+    status_lines = [("No QR code detected", (50, 200), (255, 255, 255))]  # (text, origin, color)
+    overlay = OverlayLayer()
+    button_pressed = False
+    pressed_button = None  # (track id, text)
+    
+    # QR codes followed across frames, each keeps its buttons on screen for 5 seconds after it was last seen
+    code_tracker = CodeTracker(timeout=5)
+    
+    # Action messages
+    action_message = ''
+    action_message_time = 0  # Time when the action message was set
+    
+    # Button actions run in the background so the video never freezes
+    actions = ActionExecutor()
+    
+    # Cooldown variables to prevent multiple triggers
+    button_cooldown = 2  # Seconds
+    last_button_press_time = 0
+
+    # Latest decode and hand tracking results, reused while the scene is static
+    decoded_objects = []
+    results = None
+
+    # Capture and display buffers, refilled in place every frame
+    raw_frame = None
+    display_frame = None
+
+    # Without a window there is no 'q' key, so Ctrl+C ends the loop and still cleans up
+    interrupted = threading.Event()
+    if args.no_window:
+        signal.signal(signal.SIGINT, lambda signum, stack: interrupted.set())
+
+    while True:
+        if pipeline is None:
+            start = perf.start()
+            ret, raw_frame = cap.read(raw_frame)
+            if not ret:
+                print("End of recording" if replay else "Failed to grab frame")
+                break
+            perf.add('capture', start)
+            if scheduler is not None:
+                scheduler.begin_frame()
+            
+            # Decoding and hand tracking work on the raw frame, their coordinates are mirrored instead
+            if motion is None or motion.changed(raw_frame):
+                # Process frame with Mediapipe
+                results = track_hands(raw_frame)
+                
+                # Decode QR codes in the frame
+                start = perf.start()
+                decoded_objects = mirror_decoded(decode_fn(raw_frame), raw_frame.shape[1])
+                perf.add('decode', start)
+
+            # Flip the frame horizontally for natural interaction
+            start = perf.start()
+            frame = display_frame = cv2.flip(raw_frame, 1, dst=display_frame)
+            perf.add('flip', start)
+        else:
+            # Newest frame combined with the newest decode and hand tracking results
+            ret, frame, decoded_objects, results = pipeline.read()
+            if not ret:
+                print("End of recording" if replay else "Failed to grab frame")
+                break
+            if scheduler is not None:
+                scheduler.begin_frame()
+
+        if recorder is not None:
+            recorder.annotate(decoded_objects, results)
+        if replay is not None:
+            replay.compare_decoded(decoded_objects)
+
+        overlay_start = perf.start()
+        # Draw polygon around every QR code
+        for obj in decoded_objects:
+            pts = [(pt.x, pt.y) for pt in obj.polygon]
+            n_pts = len(pts)
+            for i in range(n_pts):
+                cv2.line(frame, pts[i], pts[(i+1)%n_pts], (0,255,0), 3)
+
+        # Match codes to their tracks, payloads are only parsed when a code first appears
+        now = time.time()
+        if history is not None:
+            for obj in decoded_objects:
+                if obj.data:
+                    payload = parse_qr_data(obj.data)
+                    history.record(payload.type, payload.data, now)
+        if code_tracker.update(decoded_objects, now):
+            button_list = code_tracker.buttons()
+            button_index = SpatialGrid()
+            for button in button_list:
+                button_index.insert(button[1], button)
+
+            # QR code content below each code's buttons
+            status_lines = []
+            if not code_tracker.tracks:
+                status_lines.append(("No QR code detected", (50, 200), (255, 255, 255)))
+            for track in code_tracker.tracks.values():
+                if track.payload and track.slot is not None:
+                    display_text = describe_payload(track.payload)
+                    if len(code_tracker.tracks) > 1 and len(display_text) > 22:
+                        display_text = display_text[:20] + '...'
+                    x1, _, _, y2 = slot_rect(track.slot)
+                    status_lines.append((display_text, (x1, y2 + 50), (255, 255, 255)))
+        
+        # Pick up results of actions that finished in the background
+        for message in actions.poll():
+            action_message = message
+            action_message_time = time.time()
+
+        # Display action message, pending actions keep theirs on screen until they finish
+        overlay_lines = status_lines
+        if action_message and (actions.pending or (time.time() - action_message_time) < 3):
+            overlay_lines = status_lines + [(action_message, (50, 250), (0, 255, 0))]
+        else:
+            action_message = ''  # Clear the message
+
+        # Buttons and text are only redrawn when they change
+        overlay.update(frame.shape, button_list, pressed_button if button_pressed else None, overlay_lines)
+        overlay.draw(frame)
+
+        # Hand tracking is only needed while there are buttons to press
+        hand_tracker.set_active(bool(button_list))
+        if not button_list:
+            results = None
+
+        # Check for hand landmarks
+        if results is not None and results.multi_hand_landmarks:
+            for hand_landmarks in results.multi_hand_landmarks:
+                # Get the tip of the index finger
+                index_finger_tip = hand_tracker.index_finger_tip(hand_landmarks)
+                h, w, c = frame.shape
+                index_x, index_y = int(index_finger_tip.x * w), int(index_finger_tip.y * h)
+                
+                # Draw circle at index finger tip
+                cv2.circle(frame, (index_x, index_y), 10, (255, 0, 0), cv2.FILLED)
+                
+                # Check if index finger tip is over any button
+                button = button_index.query_point(index_x, index_y)
+                if button is not None:
+                    # Button is being "pressed"
+                    text, _, track_id = button
+                    current_time = time.time()
+                    if current_time - last_button_press_time > button_cooldown and not actions.is_pending(text):
+                        last_button_press_time = current_time
+                        pressed_button = (track_id, text)
+                        actions.submit(text, code_tracker.tracks[track_id].payload)
+                        action_message = f"{text}..."
+                        action_message_time = time.time()
+                    button_pressed = True
+                else:
+                    button_pressed = False
+                
+                # Draw hand landmarks
+                hand_tracker.draw_landmarks(frame, hand_landmarks)
+        else:
+            button_pressed = False
+
+        if hud is not None:
+            hud.draw(frame)
+        start = perf.add('overlay', overlay_start)
+        
+        key = 0xFF
+        if not args.no_window:
+            cv2.imshow('QR Code Scanner', frame)
+            key = cv2.waitKey(1) & 0xFF
+        perf.add('display', start)
+        perf.frame()
+        if scheduler is not None:
+            scheduler.end_frame(bool(code_tracker.tracks), bool(results is not None and results.multi_hand_landmarks))
+        if startup.mark('first_frame'):
+            # Load the hand model now, so it is ready by the time buttons appear
+            hand_tracker.load_async()
+        if decoded_objects:
+            startup.mark('first_decode')
+        if alloc_report is not None:
+            alloc_report.frame(loading=hand_tracker.loading)
+
+        if args.perf_export and time.time() - last_export_time > 5:
+            export_timings(perf, args.perf_export)
+            last_export_time = time.time()
+
+        if key == ord('q') or interrupted.is_set():
+            break
+        elif key == ord('c') and actions.pending:
+            actions.cancel()
+            action_message = "Action cancelled."
+            action_message_time = time.time()
+    
+    actions.shutdown()
+    if pipeline is not None:
+        pipeline.stop()
+    hand_tracker.close()
+    if history is not None:
+        history.close()
+    if recorder is not None:
+        recorder.close()
+    if replay is not None:
+        replay.print_summary()
+    if alloc_report is not None:
+        alloc_report.print_summary()
+    if args.perf_export:
+        export_timings(perf, args.perf_export)
+    if metrics_server is not None:
+        metrics_server.shutdown()
+    cap.release()
+    if not args.no_window:
+        cv2.destroyAllWindows()
+
+    if pyramid is not None:
+        pyramid.print_stats()
+    print(f"Startup: {startup.summary()}")
+    if args.startup_report:
+        with open(args.startup_report, 'w', encoding='utf-8') as file:
+            json.dump(startup.milestones, file)
+
+# Result shape shared by every decoder backend: raw payload bytes and a list of Point corners
+Point = namedtuple('Point', ['x', 'y'])  # Same fields as pyzbar's Point
+DecodedQR = namedtuple('DecodedQR', ['data', 'polygon'])
+
+def to_gray(frame, buffers=None):
+    if frame.ndim == 2:
+        return frame
+    dst = buffers.get('gray', frame.shape[:2]) if buffers is not None else None
+    return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=dst)
+
+class FrameBufferPool:
+    """
+    Named arrays reused from frame to frame, reallocated only when the frame size changes
+    """
+    def __init__(self):
+        self.buffers = {}
+
+    def get(self, name, shape, dtype=np.uint8):
+        buffer = self.buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self.buffers[name] = np.empty(shape, dtype)
+        return buffer
+
+def mirror_decoded(decoded_objects, width):
+    """
+    Mirror polygons of QR codes decoded on the raw camera frame into the flipped display frame
+    """
+    return [obj._replace(polygon=[Point(width - 1 - pt.x, pt.y) for pt in obj.polygon])
+            for obj in decoded_objects]
+
+class PyzbarBackend:
+    """
+    QR decoding with ZBar through pyzbar
+    """
+    name = 'pyzbar'
+
+    def __init__(self):
+        # Loading ZBar takes a while, so it only happens once this backend is chosen
+        from pyzbar.pyzbar import decode, ZBarSymbol
+        self._decode = decode
+        self.symbols = [ZBarSymbol.QRCODE]
+        self.buffers = FrameBufferPool()
+
+    def decode(self, image):
+        gray = to_gray(image, self.buffers)
+        return [DecodedQR(obj.data, [Point(pt.x, pt.y) for pt in obj.polygon])
+                for obj in self._decode(gray, symbols=self.symbols)]
+
+class OpenCVBackend:
+    """
+    QR decoding with OpenCV's QRCodeDetector, or the ArUco based detector
+    """
+    def __init__(self, aruco=False):
+        self.name = 'opencv-aruco' if aruco else 'opencv'
+        self.detector = cv2.QRCodeDetectorAruco() if aruco else cv2.QRCodeDetector()
+        self.buffers = FrameBufferPool()
+
+    def decode(self, image):
+        image = to_gray(image, self.buffers)
+        ok, texts, points, _ = self.detector.detectAndDecodeMulti(image)
+        if not ok:
+            # The multi-code search can miss codes the single-code path finds
+            text, points, _ = self.detector.detectAndDecode(image)
+            if not text or points is None:
+                return []
+            texts = [text]
+        return [DecodedQR(text.encode('utf-8'), [Point(int(round(x)), int(round(y))) for x, y in corners])
+                for text, corners in zip(texts, points) if text]
+
+DECODER_BACKENDS = {
+    'pyzbar': PyzbarBackend,
+    'opencv': OpenCVBackend,
+    'opencv-aruco': lambda: OpenCVBackend(aruco=True),
+}
+
+def create_backend(name):
+    return DECODER_BACKENDS[name]()
+
+def create_decoder(args, scaler=None):
+    """
+    Decoder chain selected on the command line, returns (decode function, PyramidDecoder or None).
+    A ScaledDecoder given as scaler goes directly above the backend.
+    """
+    if args.decoder == 'auto':
+        backend = AutoBackend([create_backend(name) for name in sorted(DECODER_BACKENDS)])
+    else:
+        backend = create_backend(args.decoder)
+    decode_fn = backend.decode
+    if scaler is not None:
+        scaler.decode_fn = decode_fn
+        decode_fn = scaler.decode
+    pyramid = None
+    if args.scales:
+        pyramid = PyramidDecoder(decode_fn=decode_fn, scales=args.scales)
+        decode_fn = pyramid.decode
+    region_decode_fn = decode_fn
+    if args.roi:
+        decode_fn = TrackingDecoder(
+            decode_fn=decode_fn,
+            full_scan_interval=args.full_scan_interval,
+            padding=args.roi_padding).decode
+    if args.consensus:
+        decode_fn = ConsensusDecoder(
+            decode_fn=decode_fn,
+            region_decode_fn=region_decode_fn,
+            window=args.consensus_window,
+            enhance=args.enhance).decode
+    return decode_fn, pyramid
+
+class AutoBackend:
+    """
+    Time every backend on the first frames containing a QR code and keep the fastest reliable one
+    """
+    def __init__(self, backends, trial_frames=10, max_trial_frames=300, min_hit_ratio=0.9):
+        self.backends = backends
+        self.trial_frames = trial_frames
+        self.max_trial_frames = max_trial_frames
+        self.min_hit_ratio = min_hit_ratio
+        self.timings = {backend.name: 0.0 for backend in backends}
+        self.hits = {backend.name: 0 for backend in backends}
+        self.frames_seen = 0
+        self.frames_with_code = 0
+        self.selected = None
+
+    @property
+    def name(self):
+        return self.selected.name if self.selected else 'auto'
+
+    def decode(self, image):
+        if self.selected is not None:
+            return self.selected.decode(image)
+
+        # Trial: run every backend on the same frame
+        self.frames_seen += 1
+        best = []
+        for backend in self.backends:
+            start = time.perf_counter()
+            decoded_objects = backend.decode(image)
+            self.timings[backend.name] += time.perf_counter() - start
+            if decoded_objects:
+                self.hits[backend.name] += 1
+                if len(decoded_objects) > len(best):
+                    best = decoded_objects
+        if best:
+            self.frames_with_code += 1
+        if self.frames_with_code >= self.trial_frames or self.frames_seen >= self.max_trial_frames:
+            self.select()
+        return best
+
+    def select(self):
+        """
+        Keep the fastest backend whose hit count is close to the best one
+        """
+        most_hits = max(self.hits.values())
+        reliable = [backend for backend in self.backends
+                    if self.hits[backend.name] >= most_hits * self.min_hit_ratio]
+        self.selected = min(reliable, key=lambda backend: self.timings[backend.name])
+        for backend in self.backends:
+            print(f"Decoder {backend.name}: {self.hits[backend.name]}/{self.frames_with_code} decoded, "
+                  f"{self.timings[backend.name] / self.frames_seen * 1000:.1f} ms per frame")
+        print(f"Using decoder {self.selected.name}")
+
+def map_decoded(obj, scale=1.0, dx=0, dy=0):
+    """
+    Map the polygon of a QR code decoded on a scaled and cropped image back to frame coordinates
+    """
+    polygon = [Point(int(round(pt.x / scale)) + dx, int(round(pt.y / scale)) + dy) for pt in obj.polygon]
+    return obj._replace(polygon=polygon)
+
+class TrackingDecoder:
+    """
+    Decode QR codes in a padded region around their last position, with periodic full frame scans
+    """
+    def __init__(self, decode_fn, full_scan_interval=30, padding=0.5, min_padding=16):
+        self.decode_fn = decode_fn
+        self.full_scan_interval = full_scan_interval
+        self.padding = padding
+        self.min_padding = min_padding
+        self.roi = None
+        self.frames_since_full_scan = 0
+        self.buffers = FrameBufferPool()
+
+    def decode(self, frame):
+        gray = to_gray(frame, self.buffers)
+        if self.roi is not None and self.frames_since_full_scan < self.full_scan_interval:
+            self.frames_since_full_scan += 1
+            x1, y1, x2, y2 = self.roi
+            decoded_objects = [map_decoded(obj, dx=x1, dy=y1) for obj in self.decode_fn(gray[y1:y2, x1:x2])]
+            if decoded_objects:
+                self.roi = self.region_around(decoded_objects, gray.shape)
+                return decoded_objects
+        # Nothing tracked, the code left the region or a periodic rescan is due
+        self.frames_since_full_scan = 0
+        decoded_objects = self.decode_fn(gray)
+        self.roi = self.region_around(decoded_objects, gray.shape) if decoded_objects else None
+        return decoded_objects
+
+    def region_around(self, decoded_objects, shape):
+        """
+        Padded bounding box (x1, y1, x2, y2) around all decoded polygons, clipped to the frame
+        """
+        xs = [pt.x for obj in decoded_objects for pt in obj.polygon]
+        ys = [pt.y for obj in decoded_objects for pt in obj.polygon]
+        pad_x = max(int((max(xs) - min(xs)) * self.padding), self.min_padding)
+        pad_y = max(int((max(ys) - min(ys)) * self.padding), self.min_padding)
+        height, width = shape[:2]
+        return (max(min(xs) - pad_x, 0), max(min(ys) - pad_y, 0),
+                min(max(xs) + pad_x, width), min(max(ys) + pad_y, height))
+
+class ScaledDecoder:
+    """
+    Decode a downscaled grayscale image and map the results back, at a scale that can change between frames
+    """
+    def __init__(self, decode_fn=None, scale=1.0):
+        self.decode_fn = decode_fn
+        self.scale = scale
+        self.buffers = FrameBufferPool()
+
+    def decode(self, image):
+        scale = self.scale
+        if scale == 1:
+            return self.decode_fn(image)
+        gray = to_gray(image, self.buffers)
+        height, width = gray.shape
+        size = (max(int(round(width * scale)), 1), max(int(round(height * scale)), 1))
+        small = cv2.resize(gray, size, dst=self.buffers.get('small', size[::-1]), interpolation=cv2.INTER_AREA)
+        return [map_decoded(obj, scale=scale) for obj in self.decode_fn(small)]
+
+class PyramidDecoder:
+    """
+    Decode QR codes coarse to fine, trying larger scales only when smaller ones find nothing
+    """
+    def __init__(self, decode_fn, scales=(0.25, 0.5, 1.0)):
+        self.decode_fn = decode_fn
+        self.scales = sorted(scales)
+        self.attempts = {scale: 0 for scale in self.scales}
+        self.hits = {scale: 0 for scale in self.scales}
+        self.buffers = FrameBufferPool()
+
+    def decode(self, frame):
+        gray = to_gray(frame, self.buffers)
+        height, width = gray.shape
+        for scale in self.scales:
+            if scale == 1:
+                image = gray
+            else:
+                size = (int(round(width * scale)), int(round(height * scale)))
+                image = cv2.resize(gray, size, dst=self.buffers.get(scale, size[::-1]),
+                                   interpolation=cv2.INTER_AREA)
+            self.attempts[scale] += 1
+            decoded_objects = self.decode_fn(image)
+            if decoded_objects:
+                self.hits[scale] += 1
+                return [map_decoded(obj, scale=scale) for obj in decoded_objects]
+        return []
+
+    def hit_rates(self):
+        """
+        Fraction of decode attempts that found a QR code at each scale
+        """
+        return {scale: self.hits[scale] / self.attempts[scale] if self.attempts[scale] else 0.0
+                for scale in self.scales}
+
+    def print_stats(self):
+        for scale, rate in self.hit_rates().items():
+            print(f"Scale {scale:g}: {self.hits[scale]}/{self.attempts[scale]} decoded ({rate:.0%})")
+
+class ConsensusTrack:
+    """
+    One code followed by ConsensusDecoder, with the payloads read on its recent frames
+    """
+    def __init__(self, window):
+        self.votes = deque(maxlen=window)  # Payload per frame, None when missed
+        self.polygon = None
+        self.bounds = None
+        self.misses = 0
+
+    def observe(self, obj):
+        self.votes.append(obj.data)
+        self.polygon = obj.polygon
+        self.bounds = polygon_bounds(obj.polygon)
+        self.misses = 0
+
+    def miss(self):
+        self.votes.append(None)
+        self.misses += 1
+
+    def payload(self):
+        """
+        Payload read most often within the window, the newest one on a tie
+        """
+        counts = Counter(vote for vote in self.votes if vote is not None)
+        if not counts:
+            return None
+        most = max(counts.values())
+        return next(vote for vote in reversed(self.votes) if counts.get(vote) == most)
+
+class ConsensusDecoder:
+    """
+    Combine decodes over a sliding window of frames: vote on each code's payload, keep codes through
+    short misses and, optionally, retry a repeatedly missed code's region with contrast enhancement
+    """
+    def __init__(self, decode_fn, region_decode_fn=None, window=5, max_misses=3, min_votes=1,
+                 enhance=None, enhance_after=2, padding=0.5, min_overlap=0.2):
+        self.decode_fn = decode_fn
+        self.region_decode_fn = region_decode_fn or decode_fn  # Decoder for cropped regions, without ROI tracking
+        self.window = window
+        self.max_misses = max_misses
+        self.min_votes = min_votes
+        self.enhance = enhance
+        self.enhance_after = enhance_after
+        self.padding = padding
+        self.min_overlap = min_overlap
+        self.tracks = []
+        self.clahe = cv2.createCLAHE(clipLimit=3.0, tileGridSize=(4, 4)) if enhance == 'clahe' else None
+        self.buffers = FrameBufferPool()
+
+    def decode(self, frame):
+        matched = set()
+        for obj in self.decode_fn(frame):
+            if not obj.data:
+                continue
+            track = self._match(obj, matched)
+            if track is None:
+                track = ConsensusTrack(self.window)
+                self.tracks.append(track)
+            track.observe(obj)
+            matched.add(track)
+
+        for track in self.tracks:
+            if track in matched:
+                continue
+            track.miss()
+            # Enhancing the whole frame would be too slow, so only the region of a code that keeps being missed
+            if self.enhance and track.misses >= self.enhance_after:
+                obj = self._decode_enhanced(frame, track.bounds)
+                if obj is not None:
+                    track.observe(obj)
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+
+        decoded_objects = []
+        for track in self.tracks:
+            payload = track.payload()
+            if payload is not None and len(track.votes) - track.votes.count(None) >= self.min_votes:
+                decoded_objects.append(DecodedQR(payload, track.polygon))
+        return decoded_objects
+
+    def _match(self, obj, matched):
+        """
+        Track of the code at the same place, or with the same payload if it moved too far between frames
+        """
+        bounds = polygon_bounds(obj.polygon)
+        best = None
+        best_overlap = self.min_overlap
+        for track in self.tracks:
+            if track in matched:
+                continue
+            overlap = overlap_ratio(bounds, track.bounds)
+            if overlap >= best_overlap:
+                best, best_overlap = track, overlap
+        if best is None:
+            for track in self.tracks:
+                if track not in matched and track.payload() == obj.data:
+                    return track
+        return best
+
+    def _decode_enhanced(self, frame, bounds):
+        gray = to_gray(frame, self.buffers)
+        height, width = gray.shape
+        x1, y1, x2, y2 = bounds
+        pad_x = int((x2 - x1) * self.padding)
+        pad_y = int((y2 - y1) * self.padding)
+        x1, y1 = max(x1 - pad_x, 0), max(y1 - pad_y, 0)
+        x2, y2 = min(x2 + pad_x, width), min(y2 + pad_y, height)
+        if x2 - x1 < 8 or y2 - y1 < 8:
+            return None
+        region = gray[y1:y2, x1:x2]
+        if self.enhance == 'clahe':
+            region = self.clahe.apply(region)
+        else:
+            region = cv2.adaptiveThreshold(region, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 5)
+        decoded_objects = self.region_decode_fn(region)
+        if not decoded_objects:
+            return None
+        return map_decoded(decoded_objects[0], dx=x1, dy=y1)
+
+class MotionDetector:
+    """
+    Cheap scene change check on a heavily downsampled grayscale frame
+    """
+    def __init__(self, threshold, size=(64, 36), max_static_frames=30):
+        self.threshold = threshold
+        self.size = size
+        self.max_static_frames = max_static_frames  # Force a refresh now and then in case a decode was missed
+        self.reference = None
+        self.static_frames = 0
+        self.buffers = FrameBufferPool()
+
+    def changed(self, frame):
+        """
+        True when the frame differs from the last changed frame by at least the threshold
+        """
+        width, height = self.size
+        small = cv2.resize(frame, self.size, dst=self.buffers.get('small', (height, width) + frame.shape[2:]),
+                           interpolation=cv2.INTER_AREA)
+        small = to_gray(small, self.buffers)
+        if self.reference is not None and self.static_frames < self.max_static_frames:
+            difference = cv2.norm(small, self.reference, cv2.NORM_L1) / small.size
+            if difference < self.threshold:
+                self.static_frames += 1
+                return False
+        if self.reference is None:
+            self.reference = small.copy()
+        else:
+            np.copyto(self.reference, small)
+        self.static_frames = 0
+        return True
+
+# Recording container: a fixed header followed by raw frames of identical shape
+RECORDING_MAGIC = b'QRSCNREC'
+RECORDING_HEADER = struct.Struct('<8sIIII')  # magic, width, height, channels, frame count
+RECORDING_HEADER_SIZE = 64
+
+def serialize_decoded(decoded_objects):
+    return [{'data': base64.b64encode(obj.data).decode('ascii'),
+             'polygon': [[pt.x, pt.y] for pt in obj.polygon]}
+            for obj in decoded_objects or []]
+
+def serialize_hands(results):
+    if results is None or not results.multi_hand_landmarks:
+        return None
+    return [[[round(lm.x, 5), round(lm.y, 5), round(lm.z, 5)] for lm in hand_landmarks.landmark]
+            for hand_landmarks in results.multi_hand_landmarks]
+
+class FrameRecorder:
+    """
+    Write raw frames to a memory-mappable container, with per-frame results in a JSON lines sidecar
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'wb')
+        self.file.write(b'\0' * RECORDING_HEADER_SIZE)
+        self.meta_file = open(path + '.jsonl', 'w', encoding='utf-8')
+        self.shape = None
+        self.frame_count = 0
+        self.start_time = None
+        self.pending = None  # Metadata of the newest frame, completed by annotate()
+        self.lock = threading.Lock()
+
+    def write_frame(self, frame):
+        if self.shape is None:
+            self.shape = frame.shape
+            self.start_time = time.perf_counter()
+        elif frame.shape != self.shape:
+            return  # The container only holds frames of one size
+        self.file.write(np.ascontiguousarray(frame).data)
+        with self.lock:
+            self._flush_pending()
+            self.pending = {'frame': self.frame_count, 'time': time.perf_counter() - self.start_time}
+            self.frame_count += 1
+
+    def annotate(self, decoded_objects, results):
+        """
+        Attach decode and hand tracking results to the newest recorded frame
+        """
+        with self.lock:
+            if self.pending is not None:
+                self.pending['decoded'] = serialize_decoded(decoded_objects)
+                self.pending['hands'] = serialize_hands(results)
+
+    def _flush_pending(self):
+        if self.pending is not None:
+            self.meta_file.write(json.dumps(self.pending) + '\n')
+            self.pending = None
+
+    def close(self):
+        with self.lock:
+            self._flush_pending()
+        height, width, channels = self.shape if self.shape else (0, 0, 0)
+        self.file.seek(0)
+        self.file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, width, height, channels, self.frame_count))
+        self.file.close()
+        self.meta_file.close()
+        print(f"Recorded {self.frame_count} frames to {self.path}")
+
+class RecordingSource:
+    """
+    Capture wrapper that records every frame it reads
+    """
+    def __init__(self, cap, recorder):
+        self.cap = cap
+        self.recorder = recorder
+
+    def read(self, image=None):
+        ret, frame = self.cap.read(image)
+        if ret:
+            self.recorder.write_frame(frame)
+        return ret, frame
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def release(self):
+        self.cap.release()
+
+# Stand-ins for Mediapipe results rebuilt from a recording
+ReplayLandmark = namedtuple('ReplayLandmark', ['x', 'y', 'z'])
+ReplayHandLandmarks = namedtuple('ReplayHandLandmarks', ['landmark'])
+ReplayHandResults = namedtuple('ReplayHandResults', ['multi_hand_landmarks'])
+
+class ReplaySource:
+    """
+    Read frames of a recording through a memory map, behaving like cv2.VideoCapture
+    """
+    def __init__(self, path, realtime=True):
+        self.path = path
+        self.realtime = realtime
+        self.frames = None
+        self.meta = []
+        self.frame_index = -1
+        self.start_time = None
+        self.decode_matches = 0
+        self.decode_compared = 0
+        try:
+            with open(path, 'rb') as file:
+                magic, width, height, channels, count = RECORDING_HEADER.unpack(
+                    file.read(RECORDING_HEADER.size))
+        except (OSError, struct.error) as e:
+            print(f"Error opening recording: {e}")
+            return
+        if magic != RECORDING_MAGIC:
+            print(f"Not a recording: {path}")
+            return
+        frame_size = width * height * channels
+        if frame_size:
+            # A recording that was never closed still holds every completely written frame
+            available = (os.path.getsize(path) - RECORDING_HEADER_SIZE) // frame_size
+            count = count or available
+            self.frames = np.memmap(path, dtype=np.uint8, mode='r', offset=RECORDING_HEADER_SIZE,
+                                    shape=(min(count, available), height, width, channels))
+        if os.path.exists(path + '.jsonl'):
+            with open(path + '.jsonl', encoding='utf-8') as file:
+                self.meta = [json.loads(line) for line in file]
+
+    def isOpened(self):
+        return self.frames is not None and len(self.frames) > 0
+
+    def read(self, image=None):
+        # Frames are views into the memory map, so a buffer to read into is never needed
+        if self.frames is None or self.frame_index + 1 >= len(self.frames):
+            return False, None
+        self.frame_index += 1
+        if self.realtime:
+            # Keep the recorded pacing
+            if self.start_time is None:
+                self.start_time = time.perf_counter()
+            target = self.frame_meta(self.frame_index).get('time')
+            if target is not None:
+                delay = target - (time.perf_counter() - self.start_time)
+                if delay > 0:
+                    time.sleep(delay)
+        return True, self.frames[self.frame_index]
+
+    def frame_meta(self, index):
+        return self.meta[index] if 0 <= index < len(self.meta) else {}
+
+    def hand_results(self):
+        """
+        Recorded hand landmarks of the newest frame as Mediapipe-like results
+        """
+        hands = self.frame_meta(self.frame_index).get('hands')
+        if not hands:
+            return ReplayHandResults(None)
+        return ReplayHandResults([ReplayHandLandmarks([ReplayLandmark(*point) for point in hand])
+                                  for hand in hands])
+
+    def compare_decoded(self, decoded_objects):
+        """
+        Count frames whose decoded payloads match the recording, to A/B decoder changes
+        """
+        recorded = self.frame_meta(self.frame_index).get('decoded')
+        if recorded is None:
+            return
+        self.decode_compared += 1
+        if sorted(base64.b64decode(obj['data']) for obj in recorded) == sorted(obj.data for obj in decoded_objects):
+            self.decode_matches += 1
+
+    def print_summary(self):
+        if self.decode_compared:
+            print(f"Decode results matched the recording on {self.decode_matches}/{self.decode_compared} frames")
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            return len(self.frames) if self.frames is not None else 0
+        return 0
+
+    def release(self):
+        self.frames = None
+
+# Landmark pairs of Mediapipe's hand model
+HAND_CONNECTIONS = (
+    (0, 1), (1, 2), (2, 3), (3, 4), (0, 5), (5, 6), (6, 7), (7, 8),
+    (5, 9), (9, 10), (10, 11), (11, 12), (9, 13), (13, 14), (14, 15), (15, 16),
+    (13, 17), (0, 17), (17, 18), (18, 19), (19, 20),
+)
+INDEX_FINGER_TIP = 8
+
+class ReplayHandTracker:
+    """
+    HandTracker replacement that returns recorded landmarks, so Mediapipe is never loaded
+    """
+    def __init__(self, replay):
+        self.replay = replay
+        self.active = False
+
+    def set_active(self, active):
+        self.active = active
+
+    @property
+    def loading(self):
+        # Recorded landmarks need no model
+        return False
+
+    def load_async(self):
+        pass
+
+    def process(self, frame):
+        if not self.active:
+            return None
+        return self.replay.hand_results()
+
+    def index_finger_tip(self, hand_landmarks):
+        return hand_landmarks.landmark[INDEX_FINGER_TIP]
+
+    def draw_landmarks(self, frame, hand_landmarks):
+        h, w = frame.shape[:2]
+        points = [(int(lm.x * w), int(lm.y * h)) for lm in hand_landmarks.landmark]
+        for start, end in HAND_CONNECTIONS:
+            cv2.line(frame, points[start], points[end], (255, 255, 255), 2)
+        for point in points:
+            cv2.circle(frame, point, 4, (0, 0, 255), cv2.FILLED)
+
+    def close(self):
+        pass
+
+PERF_STAGES = ('capture', 'flip', 'convert', 'decode', 'hands', 'overlay', 'display')
+
+class StageTimings:
+    """
+    Rolling latency samples of every pipeline stage in fixed-size ring buffers
+    """
+    def __init__(self, size=512):
+        self.size = size
+        # Each stage is only written by one thread, readers may see a sample being replaced
+        self.samples = {stage: np.zeros(size) for stage in PERF_STAGES}
+        self.counts = {stage: 0 for stage in PERF_STAGES}
+        self.totals = {stage: 0.0 for stage in PERF_STAGES}
+        self.frame_times = np.zeros(size)
+        self.frame_count = 0
+
+    def start(self):
+        return time.perf_counter()
+
+    def add(self, stage, start):
+        """
+        Record the time since start for a stage, returns the current time so stages can be chained
+        """
+        now = time.perf_counter()
+        count = self.counts[stage]
+        self.samples[stage][count % self.size] = now - start
+        self.counts[stage] = count + 1
+        self.totals[stage] += now - start
+        return now
+
+    def frame(self):
+        self.frame_times[self.frame_count % self.size] = time.perf_counter()
+        self.frame_count += 1
+
+    def fps(self):
+        count = min(self.frame_count, self.size)
+        if count < 2:
+            return 0.0
+        times = self.frame_times[:count]
+        elapsed = times.max() - times.min()
+        return (count - 1) / elapsed if elapsed > 0 else 0.0
+
+    def percentiles(self, stage, quantiles=(50, 95, 99)):
+        """
+        Latency percentiles of a stage in seconds, or None before the first sample
+        """
+        count = min(self.counts[stage], self.size)
+        if not count:
+            return None
+        return np.percentile(self.samples[stage][:count], quantiles)
+
+    def snapshot(self):
+        stages = {}
+        for stage in PERF_STAGES:
+            values = self.percentiles(stage)
+            if values is None:
+                continue
+            stages[stage] = {
+                'p50': float(values[0]), 'p95': float(values[1]), 'p99': float(values[2]),
+                'count': self.counts[stage], 'sum': self.totals[stage],
+            }
+        return {'fps': self.fps(), 'frames': self.frame_count, 'stages': stages}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        snapshot = self.snapshot()
+        lines = [
+            "# HELP qr_scanner_fps Displayed frames per second",
+            "# TYPE qr_scanner_fps gauge",
+            f"qr_scanner_fps {snapshot['fps']:.3f}",
+            "# HELP qr_scanner_stage_seconds Latency of each frame processing stage",
+            "# TYPE qr_scanner_stage_seconds summary",
+        ]
+        for stage, values in snapshot['stages'].items():
+            for quantile, key in (('0.5', 'p50'), ('0.95', 'p95'), ('0.99', 'p99')):
+                lines.append(f'qr_scanner_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {values[key]:.6f}')
+            lines.append(f'qr_scanner_stage_seconds_sum{{stage="{stage}"}} {values["sum"]:.6f}')
+            lines.append(f'qr_scanner_stage_seconds_count{{stage="{stage}"}} {values["count"]}')
+        return '\n'.join(lines) + '\n'
+
+class StartupTimer:
+    """
+    Seconds from process start until each startup milestone was first reached
+    """
+    def __init__(self, start):
+        self.start = start
+        self.milestones = {}
+
+    def mark(self, name):
+        """
+        Record the milestone unless it was reached before, returns True the first time
+        """
+        if name in self.milestones:
+            return False
+        self.milestones[name] = time.perf_counter() - self.start
+        return True
+
+    def summary(self):
+        return ", ".join(f"{name.replace('_', ' ')} {seconds:.2f}s" for name, seconds in self.milestones.items())
+
+class NullTimings:
+    """
+    Stand-in for StageTimings when measurements are disabled
+    """
+    def start(self):
+        return 0.0
+
+    def add(self, stage, start):
+        return 0.0
+
+    def frame(self):
+        pass
+
+NULL_TIMINGS = NullTimings()
+
+class AllocationReport:
+    """
+    Traced memory allocated within each frame and garbage collections, once the first frames have warmed up
+    """
+    def __init__(self, warmup_frames=60):
+        # Only imported for the report, tracing is never needed otherwise
+        import tracemalloc
+        self.tracemalloc = tracemalloc
+        self.warmup_frames = warmup_frames
+        self.frames = 0
+        self.steady_frames = 0
+        self.frame_peaks = 0
+        self.max_frame_peak = 0
+        self.steady_start = None
+        self.current = 0
+        self.collections = [0, 0, 0]
+        tracemalloc.start()
+        self.frame_start, _ = tracemalloc.get_traced_memory()
+        gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        if phase == 'start' and self.frames >= self.warmup_frames:
+            self.collections[info['generation']] += 1
+
+    def frame(self, loading=False):
+        """
+        Close the current frame: the peak above the traced memory at its start is what it allocated.
+        While something loads in the background, such as the hand model, the warm-up starts over.
+        """
+        self.current, peak = self.tracemalloc.get_traced_memory()
+        self.frames = 0 if loading else self.frames + 1
+        if self.frames > self.warmup_frames:
+            self.steady_frames += 1
+            self.frame_peaks += peak - self.frame_start
+            self.max_frame_peak = max(self.max_frame_peak, peak - self.frame_start)
+        elif self.frames == self.warmup_frames:
+            self.steady_start = self.current
+        self.tracemalloc.reset_peak()
+        self.frame_start = self.current
+
+    def print_summary(self):
+        gc.callbacks.remove(self._on_gc)
+        self.tracemalloc.stop()
+        if not self.steady_frames:
+            print(f"Allocation report needs more than {self.warmup_frames} frames")
+            return
+        per_frame = self.frame_peaks / self.steady_frames
+        print(f"Allocations over {self.steady_frames} steady-state frames: "
+              f"{per_frame / 1024:.1f} KiB per frame on average, {self.max_frame_peak / 1024:.1f} KiB at most")
+        print(f"Traced memory growth: {(self.current - self.steady_start) / 1024:+.1f} KiB")
+        print("Garbage collections per 1000 frames: " + ", ".join(
+            f"generation {generation} {count * 1000 / self.steady_frames:.1f}"
+            for generation, count in enumerate(self.collections)))
+
+class PerformanceHUD:
+    """
+    On-screen FPS and stage latency percentiles, refreshed twice a second
+    """
+    def __init__(self, perf, scheduler=None, refresh_interval=0.5):
+        self.perf = perf
+        self.scheduler = scheduler
+        self.refresh_interval = refresh_interval
+        self.lines = []
+        self.last_refresh = 0
+
+    def draw(self, frame):
+        if time.time() - self.last_refresh > self.refresh_interval:
+            self.last_refresh = time.time()
+            self.lines = [f"FPS {self.perf.fps():.1f}   p50/p95/p99 ms"]
+            for stage in PERF_STAGES:
+                values = self.perf.percentiles(stage)
+                if values is not None:
+                    p50, p95, p99 = values * 1000
+                    self.lines.append(f"{stage:<8} {p50:6.1f} {p95:6.1f} {p99:6.1f}")
+            if self.scheduler is not None:
+                self.lines.extend(self.scheduler.describe_lines())
+        x = frame.shape[1] - 330
+        for i, line in enumerate(self.lines):
+            cv2.putText(frame, line, (x, 30 + i * 22), cv2.FONT_HERSHEY_SIMPLEX, 0.55, (0,255,255), 1)
+
+# (decode interval, decode scale, hand tracking interval), from full quality to cheapest
+SCHEDULER_LEVELS = (
+    (1, 1.0, 1),
+    (1, 1.0, 2),
+    (2, 1.0, 2),
+    (2, 0.75, 3),
+    (3, 0.75, 3),
+    (3, 0.5, 4),
+    (4, 0.5, 6),
+    (6, 0.5, 8),
+)
+IDLE_DECODE_INTERVAL = 3  # No code on screen: a new one is still found within a tenth of a second at 30 FPS
+HAND_SEARCH_INTERVAL = 3  # Buttons on screen but no hand in view yet
+
+class FrameScheduler:
+    """
+    Decode and hand tracking rates, and decode resolution, adapted to measured stage costs to keep frames within a budget
+    """
+    def __init__(self, decode_fn, scaler, hand_tracker, budget, serial=True, smoothing=0.1, decision_interval=0.5,
+                 warmup_frames=10):
+        self.decode_fn = decode_fn
+        self.scaler = scaler  # ScaledDecoder at the bottom of decode_fn's chain, so stateful decoders above keep frame coordinates
+        self.hand_tracker = hand_tracker
+        self.budget = budget  # Seconds per frame
+        self.serial = serial
+        # Worker threads only run alongside the display loop when there is more than one core
+        self.parallel = not serial and (os.cpu_count() or 1) > 1
+        self.smoothing = smoothing
+        self.decision_interval = decision_interval
+        self.warmup_frames = warmup_frames  # First frames are slowed down by initialisation and not measured
+        self.frames = 0
+        self.level = 0
+        self.decode_interval, self.decode_scale, self.hand_interval = SCHEDULER_LEVELS[0]
+        # Smoothed costs in seconds: one decode at each scale used so far, one hand tracking run and the rest of a frame
+        self.decode_costs = {}
+        self.hand_cost = None
+        self.other_cost = None
+        self.predicted = 0.0
+        self.activity = None
+        self.frame_start = 0.0
+        self.inline_cost = 0.0  # Decoding and hand tracking time within the current frame in serial mode
+        self.last_decision = time.perf_counter()
+        self._decoded = None
+        self._decode_wait = 0
+        self._hand_results = None
+        self._hands_wait = 0
+        hand_tracker.interval = 1  # Skipped frames are decided here instead
+
+    def _smooth(self, average, sample):
+        return sample if average is None else average + self.smoothing * (sample - average)
+
+    def decode(self, frame):
+        """
+        Decode every decode_interval-th frame, returning the previous result in between
+        """
+        if self._decoded is not None and self._decode_wait > 0:
+            self._decode_wait -= 1
+            return self._decoded
+        start = time.perf_counter()
+        scale = self.scaler.scale
+        decoded_objects = self.decode_fn(frame)
+        cost = time.perf_counter() - start
+        self.decode_costs[scale] = self._smooth(self.decode_costs.get(scale), cost)
+        if self.serial:
+            self.inline_cost += cost
+        self._decoded = decoded_objects
+        self._decode_wait = self.decode_interval - 1
+        return decoded_objects
+
+    def track_hands(self, frame):
+        """
+        Track hands every hand_interval-th frame, returning the previous landmarks in between
+        """
+        if not self.hand_tracker.active:
+            self._hand_results = None
+            return None
+        if self._hand_results is not None and self._hands_wait > 0:
+            self._hands_wait -= 1
+            return self._hand_results
+        start = time.perf_counter()
+        results = self.hand_tracker.process(frame)
+        if results is not None:
+            cost = time.perf_counter() - start
+            self.hand_cost = self._smooth(self.hand_cost, cost)
+            if self.serial:
+                self.inline_cost += cost
+            self._hands_wait = self.hand_interval - 1
+        self._hand_results = results
+        return results
+
+    def begin_frame(self):
+        self.frame_start = time.perf_counter()
+        self.inline_cost = 0.0
+
+    def end_frame(self, code_active, hand_active):
+        """
+        Account the frame's remaining work and revisit the rates twice a second or when codes or hands come and go
+        """
+        now = time.perf_counter()
+        self.frames += 1
+        if self.frames <= self.warmup_frames:
+            self.decode_costs = {}
+            self.hand_cost = None
+            return
+        self.other_cost = self._smooth(self.other_cost, max(now - self.frame_start - self.inline_cost, 0.0))
+        activity = (code_active, hand_active)
+        if activity != self.activity or now - self.last_decision >= self.decision_interval:
+            self.activity = activity
+            self.last_decision = now
+            self.decide(code_active, hand_active)
+
+    def decode_cost(self, scale):
+        """
+        Measured cost of one decode at this scale, or estimated from the nearest measured scale by pixel count
+        """
+        if scale in self.decode_costs:
+            return self.decode_costs[scale]
+        if not self.decode_costs:
+            return 0.0
+        measured = min(self.decode_costs, key=lambda known: abs(known - scale))
+        return self.decode_costs[measured] * (scale / measured) ** 2
+
+    def predict(self, decode_interval, decode_scale, hand_interval):
+        """
+        Expected seconds per frame with these rates
+        """
+        decode = self.decode_cost(decode_scale) / decode_interval
+        hands = (self.hand_cost or 0.0) / hand_interval if self.hand_tracker.active else 0.0
+        other = self.other_cost or 0.0
+        if self.parallel:
+            return max(other, decode, hands)
+        return other + decode + hands
+
+    def decide(self, code_active, hand_active):
+        """
+        Use the best level predicted to fit the budget, with some headroom before moving to a more expensive one
+        """
+        for level, (decode_interval, decode_scale, hand_interval) in enumerate(SCHEDULER_LEVELS):
+            # Idle stages run less often even when there is time to spare
+            if not code_active:
+                decode_interval = max(decode_interval, IDLE_DECODE_INTERVAL)
+            if not hand_active:
+                hand_interval = max(hand_interval, HAND_SEARCH_INTERVAL)
+            predicted = self.predict(decode_interval, decode_scale, hand_interval)
+            if predicted <= self.budget * (0.85 if level < self.level else 1.0):
+                break
+        rates = (decode_interval, decode_scale, hand_interval)
+        changed = rates != (self.decode_interval, self.decode_scale, self.hand_interval)
+        self.level = level
+        self.decode_interval, self.decode_scale, self.hand_interval = rates
+        self.scaler.scale = self.decode_scale
+        self.predicted = predicted
+        if changed:
+            print(f"Scheduler: {', '.join(self.describe_lines())}")
+
+    def describe_lines(self):
+        code_active, hand_active = self.activity or (False, False)
+        state = 'hand' if hand_active else 'code' if code_active else 'idle'
+        return [f"budget {self.budget * 1000:.0f} ms, {state}, predicted {self.predicted * 1000:.1f} ms",
+                f"decode 1/{self.decode_interval} at {self.decode_scale:.0%}, hands 1/{self.hand_interval}"]
+
+def export_timings(perf, path):
+    """
+    Write the current timings to a file, as Prometheus text for .prom files and JSON otherwise
+    """
+    text = perf.to_prometheus() if path.endswith('.prom') else perf.to_json()
+    temp_path = path + '.tmp'
+    try:
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            file.write(text)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Error writing performance data: {e}")
+
+def serve_metrics(perf, port):
+    """
+    Serve the timings on localhost from a background thread
+    """
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/metrics':
+                body, content_type = perf.to_prometheus(), 'text/plain; version=0.0.4'
+            elif self.path == '/metrics.json':
+                body, content_type = perf.to_json(), 'application/json'
+            else:
+                self.send_error(404)
+                return
+            body = body.encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class LatestValue:
+    """
+    Thread-safe single slot that only keeps the newest value
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._value = None
+        self._seq = 0
+        self.closed = False
+
+    def put(self, value):
+        # Overwrite whatever is stored; a value nobody picked up yet is simply dropped
+        with self._cond:
+            self._value = value
+            self._seq += 1
+            self._cond.notify_all()
+
+    def peek(self):
+        with self._cond:
+            return self._seq, self._value
+
+    def wait_newer(self, seq, timeout=None):
+        """
+        Wait for a value newer than seq, returns (seq, value) or (seq, None) on timeout or close
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq or self.closed, timeout)
+            if self._seq <= seq:
+                return seq, None
+            return self._seq, self._value
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class FrameRing:
+    """
+    Capture buffers shared between threads, a buffer is only refilled once no thread reads it
+    """
+    def __init__(self, size=5):
+        # Enough for one frame per reader (decode, hands, display), the newest frame and the one being filled
+        self._cond = threading.Condition()
+        self.buffers = [None] * size
+        self._readers = [0] * size
+        self._latest = None
+        self._seq = 0
+        self.closed = False
+
+    def writable_slot(self):
+        with self._cond:
+            for slot, readers in enumerate(self._readers):
+                if slot != self._latest and not readers:
+                    return slot
+        raise RuntimeError("Every frame buffer is in use")
+
+    def publish(self, slot, frame):
+        with self._cond:
+            self.buffers[slot] = frame
+            self._latest = slot
+            self._seq += 1
+            self._cond.notify_all()
+
+    def acquire_newer(self, seq, timeout=None):
+        """
+        Wait for a frame newer than seq and hold its buffer until release(slot),
+        returns (seq, slot, frame) or (seq, None, None) on timeout or close
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: self._seq > seq or self.closed, timeout)
+            if self._seq <= seq:
+                return seq, None, None
+            self._readers[self._latest] += 1
+            return self._seq, self._latest, self.buffers[self._latest]
+
+    def release(self, slot):
+        with self._cond:
+            self._readers[slot] -= 1
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+class FramePipeline:
+    """
+    Capture, QR decoding and hand tracking running on separate threads
+    """
+    def __init__(self, cap, track_hands, decode_fn, motion_threshold=None, perf=None):
+        self.cap = cap
+        self.track_hands = track_hands
+        self.decode_fn = decode_fn
+        self.motion_threshold = motion_threshold
+        self.perf = perf or NULL_TIMINGS
+        self.frames = FrameRing()
+        self.decoded = LatestValue()
+        self.hand_results = LatestValue()
+        self._stop = threading.Event()
+        self._last_frame_seq = 0
+        self._display = None
+        self._threads = [
+            threading.Thread(target=self._capture_loop, daemon=True),
+            threading.Thread(target=self._worker_loop, args=(self._decode, self.decoded), daemon=True),
+            threading.Thread(target=self._worker_loop, args=(self.track_hands, self.hand_results), daemon=True),
+        ]
+
+    def start(self):
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.frames.close()
+        for thread in self._threads:
+            thread.join(timeout=1)
+
+    def read(self):
+        """
+        Wait for the next captured frame and pair it with the newest decode and hand tracking results
+        """
+        seq, slot, frame = self.frames.acquire_newer(self._last_frame_seq)
+        if frame is None:
+            return False, None, None, None
+        self._last_frame_seq = seq
+        try:
+            # Workers may still be reading the raw frame, so draw on a flipped copy in a reused buffer
+            start = self.perf.start()
+            self._display = cv2.flip(frame, 1, dst=self._display)
+            self.perf.add('flip', start)
+        finally:
+            self.frames.release(slot)
+        _, decoded_objects = self.decoded.peek()
+        _, results = self.hand_results.peek()
+        return True, self._display, decoded_objects or [], results
+
+    def _capture_loop(self):
+        try:
+            while not self._stop.is_set():
+                slot = self.frames.writable_slot()
+                start = self.perf.start()
+                ret, frame = self.cap.read(self.frames.buffers[slot])
+                if not ret:
+                    break
+                self.perf.add('capture', start)
+                self.frames.publish(slot, frame)
+        finally:
+            self.frames.close()
+
+    def _worker_loop(self, process, output):
+        # Each worker compares against the last frame it processed itself, since it skips frames independently
+        motion = MotionDetector(self.motion_threshold) if self.motion_threshold is not None else None
+        seq = 0
+        while not self._stop.is_set():
+            seq, slot, frame = self.frames.acquire_newer(seq, timeout=0.1)
+            if frame is None:
+                if self.frames.closed:
+                    break
+                continue
+            try:
+                if motion is not None and not motion.changed(frame):
+                    continue  # Static scene, the previous result still holds
+                # Only the newest frame is processed, frames captured in the meantime are skipped
+                result = process(frame)
+            finally:
+                self.frames.release(slot)
+            output.put(result)
+
+    def _decode(self, frame):
+        start = self.perf.start()
+        decoded_objects = mirror_decoded(self.decode_fn(frame), frame.shape[1])
+        self.perf.add('decode', start)
+        return decoded_objects
+
+class HandTracker:
+    """
+    Mediapipe hand tracking that is loaded on first use and only runs while active.
+    Frames are the raw camera images, landmarks are returned mirrored to match the flipped display.
+    """
+    def __init__(self, scale=1.0, interval=1, perf=None, startup=None):
+        self.scale = scale  # Inference resolution relative to the frame
+        self.interval = interval  # Track every Nth frame, reusing the last result in between
+        self.perf = perf or NULL_TIMINGS
+        self.startup = startup
+        self.active = False
+        self.mp_hands = None
+        self.mp_drawing = None
+        self.hands = None
+        self._loader = None
+        self._frame_count = 0
+        self._results = None
+        self.buffers = FrameBufferPool()
+
+    def set_active(self, active):
+        if active and not self.active:
+            self.load_async()
+        if not active:
+            self._results = None
+        self.active = active
+
+    @property
+    def loading(self):
+        return self._loader is not None and self._loader.is_alive()
+
+    def load_async(self):
+        """
+        Import Mediapipe and build the hand model in the background so the video keeps running
+        """
+        if self._loader is None:
+            self._loader = threading.Thread(target=self._load, daemon=True)
+            self._loader.start()
+
+    def _load(self):
+        import mediapipe as mp
+        mp_hands = mp.solutions.hands
+        hands = mp_hands.Hands(
+            static_image_mode=False,
+            max_num_hands=1,
+            min_detection_confidence=0.7,
+            min_tracking_confidence=0.7)
+        # Warm up the graph so the first real frame isn't slowed down by initialisation
+        hands.process(np.zeros((360, 640, 3), dtype=np.uint8))
+        self.mp_hands = mp_hands
+        self.mp_drawing = mp.solutions.drawing_utils
+        self.hands = hands
+        if self.startup is not None:
+            self.startup.mark('hand_model')
+
+    def process(self, frame):
+        """
+        Hand landmarks for the frame, or None while inactive or still loading
+        """
+        if not self.active or self.hands is None:
+            return None
+        self._frame_count += 1
+        if self._results is not None and self._frame_count % self.interval:
+            return self._results
+        start = self.perf.start()
+        if self.scale != 1:
+            # Landmarks are normalized, so they don't need rescaling
+            height, width = frame.shape[:2]
+            size = (int(round(width * self.scale)), int(round(height * self.scale)))
+            frame = cv2.resize(frame, size, dst=self.buffers.get('small', size[::-1] + frame.shape[2:]),
+                               interpolation=cv2.INTER_AREA)
+        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.buffers.get('rgb', frame.shape))
+        start = self.perf.add('convert', start)
+        results = self.hands.process(frame_rgb)
+        if results.multi_hand_landmarks:
+            # Mirror the normalized coordinates instead of flipping every frame's pixels
+            for hand_landmarks in results.multi_hand_landmarks:
+                for landmark in hand_landmarks.landmark:
+                    landmark.x = 1.0 - landmark.x
+        self._results = results
+        self.perf.add('hands', start)
+        return self._results
+
+    def index_finger_tip(self, hand_landmarks):
+        return hand_landmarks.landmark[self.mp_hands.HandLandmark.INDEX_FINGER_TIP]
+
+    def draw_landmarks(self, frame, hand_landmarks):
+        self.mp_drawing.draw_landmarks(frame, hand_landmarks, self.mp_hands.HAND_CONNECTIONS)
+
+    def close(self):
+        if self.hands is not None:
+            self.hands.close()
+    
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp'}
+VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mov', '.mkv', '.webm', '.m4v', '.mpg', '.mpeg'}
+VIDEO_CHUNK_FRAMES = 300  # Sampled video frames per batch task
+
+def run_batch(args):
+    """
+    Scan images and videos on a process pool, streaming one JSON line per decoded QR code
+    """
+    import multiprocessing
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    workers = args.workers or os.cpu_count()
+    scanned = 0
+    decoded = 0
+    start = time.time()
+    try:
+        with multiprocessing.Pool(workers, initializer=init_batch_worker, initargs=(args.decoder,)) as pool:
+            tasks = batch_tasks(args.batch, args.frame_step)
+            for frames, records in pool.imap_unordered(scan_batch_task, tasks):
+                scanned += frames
+                decoded += len(records)
+                for record in records:
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+    print(f"Scanned {scanned} frames in {time.time() - start:.1f}s, {decoded} QR codes found", file=sys.stderr)
+
+def batch_tasks(path, frame_step=1):
+    """
+    Split an image, a video or a directory into independent scanning tasks
+    """
+    if os.path.isdir(path):
+        files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    else:
+        files = [path]
+    for file_path in files:
+        extension = os.path.splitext(file_path)[1].lower()
+        if extension in IMAGE_EXTENSIONS:
+            yield ('image', file_path, 0, 1, 1)
+        elif extension in VIDEO_EXTENSIONS or file_path == path:
+            # Long videos are cut into frame ranges so several workers can share them
+            cap = cv2.VideoCapture(file_path)
+            total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            cap.release()
+            if total <= 0:
+                yield ('video', file_path, 0, None, frame_step)
+                continue
+            chunk = VIDEO_CHUNK_FRAMES * frame_step
+            for first in range(0, total, chunk):
+                yield ('video', file_path, first, min(first + chunk, total), frame_step)
+
+# Decoder of the current batch worker process
+batch_backend = None
+
+def init_batch_worker(decoder_name):
+    global batch_backend
+    # Ctrl+C is handled by the parent, which shuts the pool down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # One OpenCV thread per process, the pool provides the parallelism
+    cv2.setNumThreads(1)
+    if decoder_name == 'auto':
+        batch_backend = AutoBackend([create_backend(name) for name in sorted(DECODER_BACKENDS)])
+    else:
+        batch_backend = create_backend(decoder_name)
+
+def scan_batch_task(task):
+    """
+    Scan one image or video frame range, returns (frames scanned, records)
+    """
+    kind, file_path, first, last, frame_step = task
+    records = []
+    if kind == 'image':
+        frame = cv2.imread(file_path)
+        if frame is None:
+            print(f"Cannot read image {file_path}", file=sys.stderr)
+            return 0, records
+        records.extend(scan_records(file_path, 0, frame))
+        return 1, records
+
+    # Frames are read one at a time, so a chunk never holds more than one frame in memory
+    cap = cv2.VideoCapture(file_path)
+    if not cap.isOpened():
+        print(f"Cannot open video {file_path}", file=sys.stderr)
+        return 0, records
+    if first:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+    frames = 0
+    index = first
+    while last is None or index < last:
+        if (index - first) % frame_step:
+            if not cap.grab():
+                break
+        else:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames += 1
+            records.extend(scan_records(file_path, index, frame))
+        index += 1
+    cap.release()
+    return frames, records
+
+def scan_records(file_path, frame_index, frame):
+    """
+    JSON-ready records for every QR code decoded in a frame
+    """
+    for obj in batch_backend.decode(frame):
+        yield {'file': file_path, 'frame': frame_index, **payload_record(obj)}
+
+def payload_record(obj):
+    """
+    Payload type, raw data, parsed fields and polygon of a decoded QR code
+    """
+    payload = parse_qr_data(obj.data)
+    return {
+        'type': payload.type,
+        'data': payload.data,
+        'fields': dict(payload.fields),
+        'polygon': [[pt.x, pt.y] for pt in obj.polygon],
+    }
+
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY,
+    time REAL NOT NULL,
+    type TEXT NOT NULL,
+    data TEXT NOT NULL,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS scans_time ON scans (time);
+CREATE INDEX IF NOT EXISTS scans_type_time ON scans (type, time);
+CREATE TABLE IF NOT EXISTS codes (
+    data TEXT PRIMARY KEY,
+    type TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    first_seen REAL NOT NULL,
+    last_seen REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS codes_count ON codes (count);
+CREATE INDEX IF NOT EXISTS codes_type_count ON codes (type, count);
+"""
+
+def open_history(path):
+    import sqlite3
+    connection = sqlite3.connect(path)
+    # Readers never block the writer, and a crash loses at most the last batches
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.executescript(HISTORY_SCHEMA)
+    return connection
+
+class ScanHistory:
+    """
+    SQLite log of scanned codes, written in batches by a background thread.
+    A code seen again within ttl seconds of being logged is not logged again.
+    """
+    def __init__(self, path, ttl=60, batch_size=500, flush_interval=1.0, max_remembered=4096):
+        self.path = path
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_remembered = max_remembered
+        self.last_logged = OrderedDict()  # Code data -> time it was last logged, oldest first
+        self.queue = queue.SimpleQueue()
+        # Create the schema now so a bad path is reported at startup
+        open_history(path).close()
+        self._thread = threading.Thread(target=self._write_loop, daemon=True)
+        self._thread.start()
+
+    def record(self, payload_type, data, now, source=None):
+        """
+        Queue a sighting unless the same code was logged within the TTL, returns True when queued
+        """
+        last = self.last_logged.get(data)
+        if last is not None and now - last < self.ttl:
+            return False
+        self.last_logged[data] = now
+        self.last_logged.move_to_end(data)
+        if len(self.last_logged) > self.max_remembered:
+            self.last_logged.popitem(last=False)
+        self.queue.put((now, payload_type, data, source))
+        return True
+
+    def close(self):
+        """
+        Write everything still queued and stop the writer
+        """
+        self.queue.put(None)
+        self._thread.join()
+
+    def _write_loop(self):
+        # SQLite connections belong to the thread that opened them
+        connection = open_history(self.path)
+        try:
+            done = False
+            while not done:
+                # Wait for a first sighting, then collect more for up to flush_interval
+                item = self.queue.get()
+                batch = []
+                deadline = time.monotonic() + self.flush_interval
+                while item is not None:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    try:
+                        item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+                    except queue.Empty:
+                        break
+                done = item is None
+                if batch:
+                    write_scans(connection, batch)
+        finally:
+            connection.close()
+
+def write_scans(connection, batch):
+    """
+    Insert (time, type, data, source) rows and update the per-code counts in one transaction
+    """
+    with connection:
+        connection.executemany("INSERT INTO scans (time, type, data, source) VALUES (?, ?, ?, ?)", batch)
+        connection.executemany(
+            "INSERT INTO codes (data, type, count, first_seen, last_seen) VALUES (?, ?, 1, ?, ?) "
+            "ON CONFLICT (data) DO UPDATE SET count = count + 1, last_seen = excluded.last_seen",
+            [(data, payload_type, now, now) for now, payload_type, data, _ in batch])
+
+def query_history(args):
+    """
+    Print the most recent scans or the most frequent codes as JSON lines, newest or most frequent first
+    """
+    connection = open_history(args.history)
+    where = " WHERE type = ?" if args.type else ""
+    parameters = [args.type] if args.type else []
+    try:
+        if args.recent is not None:
+            rows = connection.execute(
+                f"SELECT time, type, data, source FROM scans{where} ORDER BY time DESC LIMIT ?",
+                parameters + [args.recent])
+            for scan_time, payload_type, data, source in rows:
+                print(json.dumps({'time': scan_time, 'type': payload_type, 'data': data, 'source': source},
+                                 ensure_ascii=False))
+        if args.top is not None:
+            rows = connection.execute(
+                f"SELECT data, type, count, first_seen, last_seen FROM codes{where} ORDER BY count DESC LIMIT ?",
+                parameters + [args.top])
+            for data, payload_type, count, first_seen, last_seen in rows:
+                print(json.dumps({'count': count, 'type': payload_type, 'data': data,
+                                  'first_seen': first_seen, 'last_seen': last_seen}, ensure_ascii=False))
+    finally:
+        connection.close()
+
+# Decode service limits
+SERVICE_MAX_HEADER_BYTES = 16 * 1024
+SERVICE_MAX_UPLOAD_BYTES = 16 * 1024 * 1024
+WEBSOCKET_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+class ServiceError(Exception):
+    """
+    Request that cannot be served, with the HTTP status or WebSocket close code to answer with
+    """
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+class ServiceBusy(Exception):
+    pass
+
+def run_service(args):
+    """
+    Serve QR decoding on localhost until interrupted
+    """
+    import asyncio
+    try:
+        asyncio.run(serve_decode(args))
+    except KeyboardInterrupt:
+        pass
+
+async def serve_decode(args):
+    import asyncio
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    workers = args.workers or os.cpu_count()
+    # Workers start on demand while connections are open, forked ones would keep client sockets alive
+    create_executor = functools.partial(ProcessPoolExecutor, workers, mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=init_batch_worker, initargs=(args.decoder,))
+    batcher = DecodeBatcher(create_executor, max_pending=args.serve_queue, batch_size=args.serve_batch,
+                            max_batches=workers)
+    try:
+        batch_task = asyncio.create_task(batcher.run())
+        server = await asyncio.start_server(
+            lambda reader, writer: handle_service_connection(reader, writer, batcher),
+            '127.0.0.1', args.serve, limit=SERVICE_MAX_HEADER_BYTES)
+        print(f"Decoding on http://127.0.0.1:{args.serve}/decode and ws://127.0.0.1:{args.serve}/stream",
+              file=sys.stderr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batch_task.cancel()
+            print(f"Served {batcher.requests} requests in {batcher.batches} batches, "
+                  f"{batcher.rejected} rejected", file=sys.stderr)
+    finally:
+        batcher.executor.shutdown()
+
+class DecodeBatcher:
+    """
+    Collect concurrent decode requests into batches for a process pool, rejecting new ones while the queue is full
+    """
+    def __init__(self, create_executor, max_pending=64, batch_size=8, max_batches=1):
+        import asyncio
+        self.create_executor = create_executor
+        self.executor = create_executor()
+        self.batch_size = batch_size
+        self.queue = asyncio.Queue(maxsize=max_pending)
+        # Batches in flight, requests arriving in the meantime wait and are batched together
+        self.slots = asyncio.Semaphore(max_batches)
+        self.requests = 0
+        self.batches = 0
+        self.rejected = 0
+
+    async def decode(self, image):
+        """
+        Decoded QR codes of an encoded image as payload records, None if the image cannot be read
+        """
+        import asyncio
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((image, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise ServiceBusy()
+        return await future
+
+    async def run(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.slots.acquire()
+            batch = [await self.queue.get()]
+            while len(batch) < self.batch_size and not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+            executor = self.executor
+            try:
+                task = loop.run_in_executor(executor, decode_images, [image for image, _ in batch])
+            except BrokenExecutor as e:
+                self._replace(executor)
+                task = loop.create_future()
+                task.set_exception(e)
+            task.add_done_callback(functools.partial(self._finish, batch, executor))
+
+    def _replace(self, executor):
+        """
+        Swap a pool broken by a dying worker for a new one, once for all the batches that failed with it
+        """
+        if executor is self.executor:
+            print("A decode worker died, restarting the pool", file=sys.stderr)
+            self.executor = self.create_executor()
+            executor.shutdown(wait=False)
+
+    def _finish(self, batch, executor, task):
+        self.slots.release()
+        self.batches += 1
+        self.requests += len(batch)
+        error = task.exception()
+        if isinstance(error, BrokenExecutor):
+            self._replace(executor)
+        results = [None] * len(batch) if error else task.result()
+        for (_, future), result in zip(batch, results):
+            # The client may have gone away in the meantime
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+def decode_images(images):
+    """
+    Decode QR codes in encoded images on a worker process, one list of records or None per image
+    """
+    results = []
+    for image in images:
+        frame = cv2.imdecode(np.frombuffer(image, np.uint8), cv2.IMREAD_COLOR)
+        results.append(None if frame is None else [payload_record(obj) for obj in batch_backend.decode(frame)])
+    return results
+
+async def handle_service_connection(reader, writer, batcher):
+    """
+    Answer HTTP requests on a keep-alive connection until it closes or switches to WebSocket
+    """
+    import asyncio
+    try:
+        while True:
+            try:
+                request = await read_http_request(reader)
+                if request is None:
+                    break
+                method, path, headers, keep_alive, body = request
+                if path == '/stream':
+                    await websocket_session(reader, writer, method, headers, batcher)
+                    break
+                if path != '/decode':
+                    raise ServiceError(404, "Unknown path, use POST /decode or a WebSocket on /stream")
+                if method != 'POST':
+                    raise ServiceError(405, "Use POST with the image file as request body")
+                status, result, extra_headers = await decode_response(batcher, body)
+                await send_http_response(writer, status, result, keep_alive, extra_headers)
+                if not keep_alive:
+                    break
+            except ServiceError as e:
+                # The rest of a rejected request may still be unread, so the connection is closed
+                await send_http_response(writer, e.code, {'error': e.message}, False)
+                break
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+async def decode_response(batcher, image):
+    """
+    Status, JSON result and extra headers for one image
+    """
+    try:
+        codes = await batcher.decode(image)
+    except ServiceBusy:
+        return 503, {'error': "Too many pending requests"}, [('Retry-After', '1')]
+    except Exception as e:
+        print(f"Decode failed: {e!r}", file=sys.stderr)
+        return 500, {'error': "Decoding failed"}, []
+    if codes is None:
+        return 400, {'error': "Cannot decode image"}, []
+    return 200, {'codes': codes}, []
+
+async def read_http_request(reader):
+    """
+    Read one request, returns (method, path, headers, keep alive, body) or None when the client closed the connection
+    """
+    import asyncio
+    try:
+        head = await reader.readuntil(b'\r\n\r\n')
+    except asyncio.IncompleteReadError as e:
+        if not e.partial.strip():
+            return None
+        raise ServiceError(400, "Incomplete request")
+    except asyncio.LimitOverrunError:
+        raise ServiceError(431, "Request headers too large")
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise ServiceError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if not line:
+            continue
+        name, separator, value = line.partition(':')
+        if not separator:
+            raise ServiceError(400, "Malformed header")
+        headers[name.strip().lower()] = value.strip()
+    if 'transfer-encoding' in headers:
+        raise ServiceError(411, "Send the image with a Content-Length")
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise ServiceError(400, "Malformed Content-Length")
+    if length < 0:
+        raise ServiceError(400, "Malformed Content-Length")
+    if length > SERVICE_MAX_UPLOAD_BYTES:
+        raise ServiceError(413, f"Images are limited to {SERVICE_MAX_UPLOAD_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b''
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return method, urlsplit(target).path, headers, keep_alive, body
+
+async def send_http_response(writer, status, result, keep_alive, extra_headers=()):
+    body = json.dumps(result, ensure_ascii=False).encode('utf-8')
+    head = [
+        f"HTTP/1.1 {status} {HTTPStatus(status).phrase}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    head.extend(f"{name}: {value}" for name, value in extra_headers)
+    writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
 
-def main():
-    # Start video capture
-    cap = cv2.VideoCapture(0)
-    if not cap.isOpened():
-        print("Cannot open webcam")
-        sys.exit(1)
-    
-    # Set window size
-    cap.set(cv2.CAP_PROP_FRAME_WIDTH, 1280)
-    cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 720)
-    
-    # Initialize Mediapipe Hand Tracking
-    mp_hands = mp.solutions.hands
-    hands = mp_hands.Hands(
-        static_image_mode=False,
-        max_num_hands=1,
-        min_detection_confidence=0.7,
-        min_tracking_confidence=0.7)
-    mp_drawing = mp.solutions.drawing_utils
-    
-    # Variables
-    qr_data = None
-    button_list = []
-    button_pressed = False
-    pressed_button = ''
-    
-    # QR code data variables
-    wifi_info = None
-    link_url = None
-    plain_text = None
-    contact_info = None
-    event_info = None
-    email_info = None
-    sms_info = None
-    geo_info = None
-    social_media_url = None
-
-    # QR code detection flag
-    qr_detected = False
-    qr_timeout = 0  # Time to keep the button on screen
-    
-    # Action messages
-    action_message = ''
-    action_message_time = 0  # Time when the action message was set
-    
-    # Cooldown variables to prevent multiple triggers
-    button_cooldown = 2  # Seconds
-    last_button_press_time = 0
+async def websocket_session(reader, writer, method, headers, batcher):
+    """
+    Decode every binary message of a WebSocket and answer each with a JSON text message, in order
+    """
+    key = headers.get('sec-websocket-key')
+    if method != 'GET' or headers.get('upgrade', '').lower() != 'websocket' or not key:
+        raise ServiceError(400, "Expected a WebSocket upgrade")
+    if headers.get('sec-websocket-version') != '13':
+        raise ServiceError(426, "Only WebSocket version 13 is supported")
+    accept = base64.b64encode(hashlib.sha1((key + WEBSOCKET_GUID).encode('ascii')).digest()).decode('ascii')
+    writer.write(("HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  f"Sec-WebSocket-Accept: {accept}\r\n\r\n").encode('ascii'))
+    await writer.drain()
 
-    while True:
+    message = bytearray()
+    message_opcode = None
+    try:
+        while True:
+            fin, opcode, payload = await read_websocket_frame(reader)
+            if opcode == 0x8:
+                writer.write(websocket_frame(0x8, payload[:2]))
+                break
+            elif opcode == 0x9:
+                writer.write(websocket_frame(0xA, payload))
+            elif opcode in (0x0, 0x1, 0x2):
+                # Fragmented messages start with a text or binary frame followed by continuations
+                if opcode:
+                    message_opcode = opcode
+                message += payload
+                if len(message) > SERVICE_MAX_UPLOAD_BYTES:
+                    raise ServiceError(1009, "Image too large")
+                if not fin:
+                    continue
+                if message_opcode == 0x2:
+                    _, result, _ = await decode_response(batcher, bytes(message))
+                else:
+                    result = {'error': "Send images as binary messages"}
+                message.clear()
+                writer.write(websocket_frame(0x1, json.dumps(result, ensure_ascii=False).encode('utf-8')))
+            await writer.drain()
+    except ServiceError as e:
+        writer.write(websocket_frame(0x8, struct.pack('>H', e.code) + e.message.encode('utf-8')))
+    await writer.drain()
+
+async def read_websocket_frame(reader):
+    """
+    Read one client frame, returns (final fragment, opcode, unmasked payload)
+    """
+    first, second = await reader.readexactly(2)
+    length = second & 0x7F
+    if length == 126:
+        length, = struct.unpack('>H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('>Q', await reader.readexactly(8))
+    if length > SERVICE_MAX_UPLOAD_BYTES:
+        raise ServiceError(1009, "Image too large")
+    if not second & 0x80:
+        raise ServiceError(1002, "Client frames must be masked")
+    mask = np.frombuffer(await reader.readexactly(4), np.uint8)
+    payload = np.frombuffer(await reader.readexactly(length), np.uint8)
+    return bool(first & 0x80), first & 0x0F, (payload ^ np.resize(mask, length)).tobytes()
+
+def websocket_frame(opcode, payload):
+    """
+    Unmasked, unfragmented server frame
+    """
+    length = len(payload)
+    if length < 126:
+        head = struct.pack('>BB', 0x80 | opcode, length)
+    elif length < 1 << 16:
+        head = struct.pack('>BBH', 0x80 | opcode, 126, length)
+    else:
+        head = struct.pack('>BBQ', 0x80 | opcode, 127, length)
+    return head + payload
+
+# Frame buffers per source in shared memory: one being captured into, one the preview may read
+SOURCE_FRAME_SLOTS = 2
+PREVIEW_TILE_SIZE = (640, 360)
+
+def run_sources(args):
+    """
+    Scan several cameras or videos at once with capture and decoding in one process per source.
+    New codes arrive on a queue and are written as JSON lines, frames reach the preview through shared memory.
+    """
+    import multiprocessing
+    from multiprocessing import resource_tracker, shared_memory
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    # Workers must share the tracker of this process, otherwise each one removes its block when it exits
+    resource_tracker.ensure_running()
+    events = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    # Number of the newest complete frame of each source, its lock guards the slot while the preview reads it
+    latest = [multiprocessing.Value('q', -1) for _ in args.sources]
+    workers = [multiprocessing.Process(target=source_worker, args=(index, source, args, events, latest[index], stop),
+                                       daemon=True)
+               for index, source in enumerate(args.sources)]
+    for worker in workers:
+        worker.start()
+
+    buffers = {}  # Source index -> shared memory block
+    frames = {}  # Source index -> array of frame slots in the block
+    preview = TiledPreview(len(args.sources)) if args.preview else None
+    history = ScanHistory(args.history, ttl=args.history_ttl) if args.history else None
+    running = len(workers)
+    decoded = 0
+    start = time.time()
+    try:
+        while running:
+            messages = []
+            try:
+                messages.append(events.get(timeout=0.03))
+                while True:
+                    messages.append(events.get_nowait())
+            except queue.Empty:
+                pass
+            for message in messages:
+                kind, index = message[:2]
+                if kind == 'open':
+                    _, _, name, shape = message
+                    buffers[index] = shared_memory.SharedMemory(name=name)
+                    frames[index] = np.ndarray((SOURCE_FRAME_SLOTS,) + shape, np.uint8, buffer=buffers[index].buf)
+                elif kind == 'decoded':
+                    record = message[2]
+                    decoded += 1
+                    output.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    output.flush()
+                    if history is not None:
+                        history.record(record['type'], record['data'], record['time'], record['source'])
+                elif kind == 'error':
+                    print(message[2], file=sys.stderr)
+                elif kind == 'end':
+                    _, _, count, seconds = message
+                    running -= 1
+                    print(f"Source {args.sources[index]}: {count} frames, "
+                          f"{count / seconds if seconds else 0:.1f} frames per second", file=sys.stderr)
+
+            if preview is not None:
+                preview.update(frames, latest)
+                cv2.imshow('QR Code Scanner', preview.canvas)
+                if cv2.waitKey(1) & 0xFF == ord('q'):
+                    break
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=2)
+            if worker.is_alive():
+                worker.terminate()
+        frames.clear()
+        for buffer in buffers.values():
+            buffer.close()
+            buffer.unlink()
+        if preview is not None:
+            cv2.destroyAllWindows()
+        if history is not None:
+            history.close()
+        if output is not sys.stdout:
+            output.close()
+    print(f"Scanned {len(args.sources)} sources in {time.time() - start:.1f}s, {decoded} QR codes found",
+          file=sys.stderr)
+
+def source_worker(index, source, args, events, latest, stop):
+    """
+    Capture and decode one source, reporting every newly tracked code as an event
+    """
+    from multiprocessing import shared_memory
+    # One OpenCV thread per process, the sources provide the parallelism
+    cv2.setNumThreads(1)
+    count = 0
+    start = time.perf_counter()
+    cap = cv2.VideoCapture(source)
+    try:
         ret, frame = cap.read()
         if not ret:
-            print("Failed to grab frame")
+            events.put(('error', index, f"Cannot open source {source}"))
+            return
+        buffer = shared_memory.SharedMemory(create=True, size=SOURCE_FRAME_SLOTS * frame.nbytes)
+        frames = None
+        try:
+            frames = np.ndarray((SOURCE_FRAME_SLOTS,) + frame.shape, np.uint8, buffer=buffer.buf)
+            frames[0] = frame
+            events.put(('open', index, buffer.name, frame.shape))
+            count = scan_source(index, source, args, cap, frames, events, latest, stop)
+        finally:
+            frames = None
+            # The aggregator unlinks the block once it is done with it
+            buffer.close()
+    finally:
+        cap.release()
+        events.put(('end', index, count, time.perf_counter() - start))
+
+def scan_source(index, source, args, cap, frames, events, latest, stop):
+    """
+    Decode frames captured straight into the shared slots, returns the number of frames scanned
+    """
+    decode_fn, _ = create_decoder(args)
+    code_tracker = CodeTracker(timeout=5)
+    frame_number = 0
+    while not stop.is_set():
+        frame = frames[frame_number % SOURCE_FRAME_SLOTS]
+        decoded_objects = decode_fn(frame)
+        known = set(code_tracker.tracks)
+        if code_tracker.update(decoded_objects, time.time()):
+            for track in code_tracker.tracks.values():
+                if track.id not in known and track.payload:
+                    events.put(('decoded', index, source_record(source, frame_number, track)))
+        for obj in decoded_objects:
+            cv2.polylines(frame, [np.array([(pt.x, pt.y) for pt in obj.polygon], np.int32)], True, (0, 255, 0), 3)
+        with latest.get_lock():
+            latest.value = frame_number
+        frame_number += 1
+        # The other slot is never the newest frame, so the preview is not reading it
+        ret, captured = cap.read(frames[frame_number % SOURCE_FRAME_SLOTS])
+        if not ret:
             break
-        
-        # Flip the frame horizontally for natural interaction
-        frame = cv2.flip(frame, 1)
-        
-        # Process frame with Mediapipe
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = hands.process(frame_rgb)
-        
-        # Decode QR codes in the frame
-        decoded_objects = decode(frame)
-        if decoded_objects:
-            obj = decoded_objects[0]  # Take the first detected QR code
-            qr_data = obj.data.decode('utf-8')
-            # Draw polygon around QR code
-            pts = obj.polygon
-            pts = [(pt.x, pt.y) for pt in pts]
-            n_pts = len(pts)
-            for i in range(n_pts):
-                cv2.line(frame, pts[i], pts[(i+1)%n_pts], (0,255,0), 3)
-            
-            qr_detected = True
-            qr_timeout = time.time()  # Reset timeout
-
-            # Process QR code data
-            # Clear previous data
-            button_list = []
-            wifi_info = None
-            link_url = None
-            plain_text = None
-            contact_info = None
-            event_info = None
-            email_info = None
-            sms_info = None
-            geo_info = None
-            social_media_url = None
-
-            # Set buttons based on QR code content
-            if qr_data:
-                if qr_data.startswith("WIFI:"):
-                    wifi_info = parse_wifi_info(qr_data)
-                    button_list = [('Connect to Wi-Fi', (50, 50, 350, 150))]
-                elif qr_data.startswith("BEGIN:VCARD"):
-                    contact_info = qr_data
-                    button_list = [('Save Contact', (50, 50, 350, 150))]
-                elif qr_data.startswith("BEGIN:VEVENT"):
-                    event_info = qr_data
-                    button_list = [('Save Event', (50, 50, 350, 150))]
-                elif qr_data.startswith("mailto:"):
-                    email_info = qr_data
-                    button_list = [('Send Email', (50, 50, 350, 150))]
-                elif qr_data.startswith("smsto:"):
-                    sms_info = qr_data
-                    button_list = [('Send SMS', (50, 50, 350, 150))]
-                elif qr_data.startswith("geo:"):
-                    geo_info = qr_data
-                    button_list = [('Open Map', (50, 50, 350, 150))]
-                elif is_social_media_link(qr_data):
-                    social_media_url = qr_data
-                    button_list = [('Open Profile', (50, 50, 350, 150))]
-                elif qr_data.startswith("http://") or qr_data.startswith("https://"):
-                    link_url = qr_data
-                    button_list = [('Go to Link', (50, 50, 350, 150))]
-                else:
-                    plain_text = qr_data
-                    button_list = [('Copy Text', (50, 50, 350, 150))]
-        else:
-            qr_detected = False
+        if captured.shape != frames.shape[1:]:
+            events.put(('error', index, f"Frame size of source {source} changed, stopping"))
+            break
+    return frame_number
 
-        # If no QR code is detected, keep the buttons for a certain time
-        if not qr_detected and (time.time() - qr_timeout) < 5:
-            pass  # Keep the existing buttons
-        else:
-            if not qr_detected:
-                # Time expired, clear the buttons
-                button_list = []
-                wifi_info = None
-                link_url = None
-                plain_text = None
-                contact_info = None
-                event_info = None
-                email_info = None
-                sms_info = None
-                geo_info = None
-                social_media_url = None
-
-        # Draw buttons
-        for button in button_list:
-            text, (x1, y1, x2, y2) = button
-            is_pressed = False
-            if button_pressed and pressed_button == text:
-                is_pressed = True
-            draw_button(frame, text, x1, y1, x2, y2, is_pressed)
-        
-        # Display QR code content
-        if wifi_info:
-            display_text = f"SSID: {wifi_info['SSID']}"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif contact_info:
-            display_text = "Contact Information Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif event_info:
-            display_text = "Event Information Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif email_info:
-            display_text = "Email Address Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif sms_info:
-            display_text = "SMS Information Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif geo_info:
-            display_text = "Geolocation Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif social_media_url:
-            display_text = "Social Media Profile Detected"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif link_url:
-            display_text = f"Link: {link_url}"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        elif plain_text:
-            display_text = f"Text: {plain_text}"
-            cv2.putText(frame, display_text, (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        else:
-            cv2.putText(frame, "No QR code detected", (50, 200), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255,255,255), 2)
-        
-        # Display action message
-        if action_message and (time.time() - action_message_time) < 3:
-            cv2.putText(frame, action_message, (50, 250), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (0,255,0), 2)
-        else:
-            action_message = ''  # Clear the message
+def source_record(source, frame_index, track):
+    """
+    JSON-ready record of a code that appeared in one of several sources
+    """
+    payload = track.payload
+    return {
+        'source': str(source),
+        'frame': frame_index,
+        'track': track.id,
+        'time': track.last_seen,
+        'type': payload.type,
+        'data': payload.data,
+        'fields': dict(payload.fields),
+        'bounds': list(track.bounds),
+    }
+
+class TiledPreview:
+    """
+    One window showing the newest frame of every source in a grid
+    """
+    def __init__(self, count, tile_size=PREVIEW_TILE_SIZE):
+        self.tile_size = tile_size
+        self.columns = math.ceil(math.sqrt(count))
+        rows = math.ceil(count / self.columns)
+        width, height = tile_size
+        self.canvas = np.zeros((rows * height, self.columns * width, 3), np.uint8)
+        self.shown = [-1] * count
+
+    def update(self, frames, latest):
+        """
+        Redraw the tiles of sources with a newer frame, frames maps source index to its frame slots
+        """
+        for index, slots in frames.items():
+            with latest[index].get_lock():
+                frame_number = latest[index].value
+                if frame_number > self.shown[index]:
+                    self.draw(index, slots[frame_number % SOURCE_FRAME_SLOTS])
+                    self.shown[index] = frame_number
+
+    def draw(self, index, frame):
+        width, height = self.tile_size
+        row, column = divmod(index, self.columns)
+        tile = self.canvas[row * height:(row + 1) * height, column * width:(column + 1) * width]
+        cv2.resize(frame, self.tile_size, dst=tile, interpolation=cv2.INTER_AREA)
+
+class SpatialGrid:
+    """
+    Uniform grid of rectangles for point and overlap lookups that don't scan every entry
+    """
+    def __init__(self, cell_size=128):
+        self.cell_size = cell_size
+        self.cells = {}
+
+    def _cells(self, rect):
+        x1, y1, x2, y2 = rect
+        size = self.cell_size
+        for cx in range(int(x1) // size, int(x2) // size + 1):
+            for cy in range(int(y1) // size, int(y2) // size + 1):
+                yield cx, cy
+
+    def insert(self, rect, item):
+        for cell in self._cells(rect):
+            self.cells.setdefault(cell, []).append((rect, item))
+
+    def query_point(self, x, y):
+        """
+        First item whose rectangle contains the point, or None
+        """
+        for (x1, y1, x2, y2), item in self.cells.get((int(x) // self.cell_size, int(y) // self.cell_size), ()):
+            if x1 < x < x2 and y1 < y < y2:
+                return item
+        return None
+
+    def query_rect(self, rect):
+        """
+        Items whose rectangles may overlap the given one
+        """
+        found = {}
+        for cell in self._cells(rect):
+            for _, item in self.cells.get(cell, ()):
+                found[id(item)] = item
+        return list(found.values())
+
+def polygon_bounds(polygon):
+    xs = [pt.x for pt in polygon]
+    ys = [pt.y for pt in polygon]
+    return min(xs), min(ys), max(xs), max(ys)
+
+def overlap_ratio(a, b):
+    """
+    Intersection over union of two (x1, y1, x2, y2) rectangles
+    """
+    width = min(a[2], b[2]) - max(a[0], b[0])
+    height = min(a[3], b[3]) - max(a[1], b[1])
+    if width <= 0 or height <= 0:
+        return 0.0
+    intersection = width * height
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union else 0.0
+
+# Button slots, one per QR code, laid out left to right and top to bottom
+SLOT_COLUMNS = 3
+SLOT_ROWS = 3
+
+def slot_rect(slot):
+    column, row = slot % SLOT_COLUMNS, slot // SLOT_COLUMNS
+    x1 = 50 + column * 350
+    y1 = 50 + row * 220
+    return x1, y1, x1 + 300, y1 + 100
+
+class QRTrack:
+    """
+    One QR code followed across frames
+    """
+    def __init__(self, track_id, data, bounds, payload, slot, now):
+        self.id = track_id
+        self.data = data
+        self.bounds = bounds
+        self.payload = payload
+        self.slot = slot
+        self.last_seen = now
+
+class CodeTracker:
+    """
+    Give every QR code in view a stable track ID by matching polygons across frames
+    """
+    def __init__(self, timeout=5, min_overlap=0.2):
+        self.timeout = timeout
+        self.min_overlap = min_overlap
+        self.tracks = {}
+        self.next_id = 1
+
+    def update(self, decoded_objects, now):
+        """
+        Match decoded codes to tracks and expire old ones, returns True when the set of tracks changed
+        """
+        changed = False
+        grid = SpatialGrid()
+        for track in self.tracks.values():
+            grid.insert(track.bounds, track)
+        matched = set()
+        for obj in decoded_objects:
+            bounds = polygon_bounds(obj.polygon)
+            track = self._match(obj.data, bounds, grid, matched)
+            if track is None:
+                track = self._create(obj.data, bounds, now)
+                changed = True
+            track.bounds = bounds
+            track.last_seen = now
+            matched.add(track.id)
+        for track_id in [track_id for track_id, track in self.tracks.items()
+                         if track_id not in matched and now - track.last_seen > self.timeout]:
+            del self.tracks[track_id]
+            changed = True
+        return changed
+
+    def _match(self, data, bounds, grid, matched):
+        best = None
+        best_overlap = self.min_overlap
+        for track in grid.query_rect(bounds):
+            if track.id in matched or track.data != data:
+                continue
+            overlap = overlap_ratio(bounds, track.bounds)
+            if overlap >= best_overlap:
+                best, best_overlap = track, overlap
+        if best is None:
+            # The code moved too far between decodes, fall back to its data
+            for track in self.tracks.values():
+                if track.id not in matched and track.data == data:
+                    return track
+        return best
+
+    def _create(self, data, bounds, now):
+        payload = parse_qr_data(data) if data else None
+        used_slots = {track.slot for track in self.tracks.values()}
+        slot = next((slot for slot in range(SLOT_COLUMNS * SLOT_ROWS) if slot not in used_slots), None)
+        track = QRTrack(self.next_id, data, bounds, payload, slot, now)
+        self.tracks[track.id] = track
+        self.next_id += 1
+        return track
+
+    def buttons(self):
+        """
+        Buttons of all tracks as (text, rect, track id)
+        """
+        return [(PAYLOAD_BUTTONS[track.payload.type], slot_rect(track.slot), track.id)
+                for track in self.tracks.values()
+                if track.payload and track.slot is not None]
 
-        # Check for hand landmarks
-        if results.multi_hand_landmarks:
-            for hand_landmarks in results.multi_hand_landmarks:
-                # Get the tip of the index finger
-                index_finger_tip = hand_landmarks.landmark[mp_hands.HandLandmark.INDEX_FINGER_TIP]
-                h, w, c = frame.shape
-                index_x, index_y = int(index_finger_tip.x * w), int(index_finger_tip.y * h)
-                
-                # Draw circle at index finger tip
-                cv2.circle(frame, (index_x, index_y), 10, (255, 0, 0), cv2.FILLED)
-                
-                # Check if index finger tip is over any button
-                button_pressed = False
-                for button in button_list:
-                    text, (x1, y1, x2, y2) = button
-                    if x1 < index_x < x2 and y1 < index_y < y2:
-                        # Button is being "pressed"
-                        current_time = time.time()
-                        if current_time - last_button_press_time > button_cooldown:
-                            last_button_press_time = current_time
-                            pressed_button = text
-                            action_message = perform_action(
-                                text, wifi_info, link_url, plain_text,
-                                contact_info, event_info, email_info,
-                                sms_info, geo_info, social_media_url
-                            )
-                            action_message_time = time.time()
-                        button_pressed = True
-                        break
-                else:
-                    button_pressed = False
-                
-                # Draw hand landmarks
-                mp_drawing.draw_landmarks(
-                    frame, hand_landmarks, mp_hands.HAND_CONNECTIONS)
-        else:
-            button_pressed = False
-        
-        cv2.imshow('QR Code Scanner', frame)
-        
-        if cv2.waitKey(1) & 0xFF == ord('q'):
-            break
-    
-    cap.release()
-    cv2.destroyAllWindows()
-    
 def draw_button(frame, text, x1, y1, x2, y2, is_pressed=False):
     if is_pressed:
         color = (0, 255, 0)  # Green when pressed
@@ -251,52 +2718,242 @@ def draw_button(frame, text, x1, y1, x2, y2, is_pressed=False):
     text_y = y1 + (y2 - y1 + text_size[1]) // 2
     cv2.putText(frame, text, (text_x, text_y), cv2.FONT_HERSHEY_SIMPLEX, 1.0, (255, 255, 255), 2)
 
-def perform_action(action, wifi_info, link_url, plain_text, contact_info, event_info, email_info, sms_info, geo_info, social_media_url):
+class OverlayLayer:
+    """
+    Buttons and status text rendered into a cached layer only when they change,
+    then alpha blended onto every frame over just the areas they cover
+    """
+    def __init__(self):
+        self.key = None
+        self.color = None
+        self.transparency = None
+        self.regions = []  # (x1, y1, x2, y2, opaque or transparent pixels only)
+
+    def update(self, shape, buttons, pressed, lines):
+        """
+        Redraw the layer if the frame size, buttons, pressed button (track id, text) or
+        text lines (text, origin, color) differ from the cached ones, returns True when redrawn
+        """
+        key = (shape[:2], buttons, pressed, lines)
+        if key == self.key:
+            return False
+        self.key = key
+        # Rendered over black the layer holds its colors premultiplied by alpha, the difference
+        # to a rendering over white is the transparency, including antialiased text edges
+        self.color = self._render(np.zeros(shape[:2] + (3,), np.uint8), buttons, pressed, lines)
+        over_white = self._render(np.full(shape[:2] + (3,), 255, np.uint8), buttons, pressed, lines)
+        self.transparency = cv2.subtract(over_white, self.color)
+        self.regions = self._regions()
+        return True
+
+    def _regions(self):
+        """
+        Non-overlapping boxes around the drawn elements, dilated so the glyphs of a line form one box
+        """
+        transparency = self.transparency[:, :, 0]  # Equal in every channel
+        opacity = cv2.dilate(255 - transparency, np.ones((9, 9), np.uint8))
+        count, _, stats, _ = cv2.connectedComponentsWithStats(opacity)
+        boxes = merge_boxes([(x, y, x + width, y + height) for x, y, width, height, _ in stats[1:count].tolist()])
+        regions = []
+        for x1, y1, x2, y2 in boxes:
+            region = transparency[y1:y2, x1:x2]
+            regions.append((x1, y1, x2, y2, not np.any((region > 0) & (region < 255))))
+        return regions
+
+    def _render(self, image, buttons, pressed, lines):
+        for text, (x1, y1, x2, y2), track_id in buttons:
+            draw_button(image, text, x1, y1, x2, y2, pressed == (track_id, text))
+        for text, origin, color in lines:
+            cv2.putText(image, text, origin, cv2.FONT_HERSHEY_SIMPLEX, 1.0, color, 2)
+        return image
+
+    def draw(self, frame):
+        for x1, y1, x2, y2, binary in self.regions:
+            roi = frame[y1:y2, x1:x2]
+            if binary:
+                # Transparency is 0 or 255 everywhere, masking is the same as scaling
+                cv2.bitwise_and(roi, self.transparency[y1:y2, x1:x2], dst=roi)
+            else:
+                cv2.multiply(roi, self.transparency[y1:y2, x1:x2], dst=roi, scale=1 / 255)
+            cv2.add(roi, self.color[y1:y2, x1:x2], dst=roi)
+
+def merge_boxes(boxes):
+    """
+    Merge overlapping (x1, y1, x2, y2) boxes until none overlap
+    """
+    boxes = list(boxes)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(boxes)):
+            for j in range(i + 1, len(boxes)):
+                a, b = boxes[i], boxes[j]
+                if a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]:
+                    boxes[i] = (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+                    del boxes[j]
+                    merged = True
+                    break
+            if merged:
+                break
+    return boxes
+
+# Seconds before an external command is killed
+COMMAND_TIMEOUT = 15
+
+# Seconds before the scanner stops waiting for an action and kills its commands
+ACTION_TIMEOUTS = {
+    'Connect to Wi-Fi': 2 * COMMAND_TIMEOUT,
+}
+DEFAULT_ACTION_TIMEOUT = COMMAND_TIMEOUT
+
+class ActionCancelled(Exception):
+    pass
+
+class ActionCommands:
+    """
+    External commands started by one action, so a timeout or cancel can kill them
+    """
+    def __init__(self):
+        self.processes = []
+        self.cancelled = False
+        self.lock = threading.Lock()
+
+    def start(self, args, **kwargs):
+        with self.lock:
+            if self.cancelled:
+                raise ActionCancelled()
+            process = subprocess.Popen(args, **kwargs)
+            self.processes.append(process)
+            return process
+
+    def kill(self):
+        with self.lock:
+            self.cancelled = True
+            for process in self.processes:
+                kill_command(process)
+
+# Commands of the action running on the current thread, set by ActionExecutor
+action_context = threading.local()
+
+class ActionExecutor:
+    """
+    Run button actions on a worker pool and collect their messages without blocking
+    """
+    def __init__(self, max_workers=2, platform_actions=None):
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='action')
+        self.pending = []  # (action, future, deadline, commands)
+        # The operating system is resolved once, and probed in the background before the first action
+        self.platform_actions = platform_actions or create_platform_actions()
+        threading.Thread(target=self.platform_actions.probe, daemon=True).start()
+
+    def submit(self, action, *args):
+        commands = ActionCommands()
+        future = self.pool.submit(self._run, commands, action, *args)
+        deadline = time.time() + ACTION_TIMEOUTS.get(action, DEFAULT_ACTION_TIMEOUT)
+        self.pending.append((action, future, deadline, commands))
+        return future
+
+    def _run(self, commands, action, *args):
+        if commands.cancelled:
+            raise ActionCancelled()
+        action_context.commands = commands
+        try:
+            return perform_action(action, *args, self.platform_actions)
+        finally:
+            action_context.commands = None
+
+    def is_pending(self, action):
+        return any(entry[0] == action for entry in self.pending)
+
+    def poll(self):
+        """
+        Messages of actions that finished or timed out since the last poll
+        """
+        messages = []
+        still_pending = []
+        for action, future, deadline, commands in self.pending:
+            if future.done():
+                try:
+                    messages.append(future.result())
+                except Exception as e:
+                    messages.append(f"{action} failed: {e}")
+            elif time.time() > deadline:
+                # The action itself can't be interrupted, but killing its commands frees the worker
+                future.cancel()
+                commands.kill()
+                messages.append(f"{action} timed out.")
+            else:
+                still_pending.append((action, future, deadline, commands))
+        self.pending = still_pending
+        return messages
+
+    def cancel(self, action=None):
+        """
+        Stop the given action, or all of them, killing their commands
+        """
+        for pending_action, future, _, commands in self.pending:
+            if action is None or pending_action == action:
+                future.cancel()
+                commands.kill()
+        self.pending = [entry for entry in self.pending if action is not None and entry[0] != action]
+
+    def shutdown(self):
+        self.cancel()
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.platform_actions.cleanup()
+
+def perform_action(action, payload, platform_actions):
+    # Only needed once an action runs, so they are imported here instead of at startup
+    import webbrowser
     message = ''
-    if action == 'Connect to Wi-Fi' and wifi_info:
-        success = connect_to_wifi(wifi_info)
+    payload_type = payload.type
+    qr_data = payload.data
+    if action == 'Connect to Wi-Fi' and payload_type == 'wifi':
+        wifi_info = payload.fields
+        success = connect_to_wifi(wifi_info, platform_actions)
         if success:
             message = f"Connected to {wifi_info['SSID']}."
         else:
             message = f"Failed to connect to {wifi_info['SSID']}."
-    elif action == 'Go to Link' and link_url:
-        webbrowser.open(link_url)
+    elif action == 'Go to Link' and payload_type == 'link':
+        webbrowser.open(qr_data)
         message = "Opening link..."
-    elif action == 'Copy Text' and plain_text:
-        pyperclip.copy(plain_text)
+    elif action == 'Copy Text' and payload_type == 'text':
+        import pyperclip
+        pyperclip.copy(qr_data)
         message = "Text copied to clipboard."
-    elif action == 'Save Contact' and contact_info:
-        success = save_contact(contact_info)
+    elif action == 'Save Contact' and payload_type == 'contact':
+        success = save_contact(qr_data, platform_actions)
         if success:
             message = "Contact saved."
         else:
             message = "Failed to save contact."
-    elif action == 'Save Event' and event_info:
-        success = save_event(event_info)
+    elif action == 'Save Event' and payload_type == 'event':
+        success = save_event(qr_data, platform_actions)
         if success:
             message = "Event saved."
         else:
             message = "Failed to save event."
-    elif action == 'Send Email' and email_info:
-        success = send_email(email_info)
+    elif action == 'Send Email' and payload_type == 'email':
+        success = send_email(qr_data)
         if success:
             message = "Opening email client."
         else:
             message = "Failed to send email."
-    elif action == 'Send SMS' and sms_info:
-        success = send_sms(sms_info)
+    elif action == 'Send SMS' and payload_type == 'sms':
+        success = send_sms(qr_data)
         if success:
             message = "Opening SMS application."
         else:
             message = "Failed to send SMS."
-    elif action == 'Open Map' and geo_info:
-        success = open_in_map(geo_info)
+    elif action == 'Open Map' and payload_type == 'geo':
+        success = open_in_map(qr_data)
         if success:
             message = "Opening location in map."
         else:
             message = "Failed to open location."
-    elif action == 'Open Profile' and social_media_url:
-        webbrowser.open(social_media_url)
+    elif action == 'Open Profile' and payload_type == 'social':
+        webbrowser.open(qr_data)
         message = "Opening social media profile..."
     return message
 
@@ -325,168 +2982,296 @@ def parse_wifi_info(qr_data):
         print(f"Error parsing Wi-Fi info: {e}")
     return None
 
-def connect_to_wifi(wifi_info):
+def parse_vcard_fields(qr_data):
     """
-    Connect to Wi-Fi network
+    Parse the properties of vCard or vEvent data, keeping the first value of each
+    """
+    fields = {}
+    for line in qr_data.splitlines():
+        name, sep, value = line.partition(':')
+        if not sep:
+            continue
+        name = name.split(';')[0].upper()
+        if name not in ('BEGIN', 'END', 'VERSION') and name not in fields:
+            fields[name] = value
+    return fields
+
+def parse_email_info(qr_data):
+    """
+    Parse mailto data into address, subject and body
+    """
+    address, _, query = qr_data[len("mailto:"):].partition('?')
+    fields = {"Address": address}
+    for key, value in parse_qsl(query):
+        fields[key.capitalize()] = value
+    return fields
+
+def parse_sms_info(qr_data):
+    """
+    Parse smsto data into phone number and message
+    """
+    parts = qr_data[len("smsto:"):].split(':', 1)
+    return {"Number": parts[0], "Message": parts[1] if len(parts) > 1 else ''}
+
+def parse_geo_info(qr_data):
+    """
+    Parse geo data into latitude and longitude
+    """
+    coordinates = qr_data[len("geo:"):].split('?')[0].split(',')
+    return {"Latitude": coordinates[0], "Longitude": coordinates[1] if len(coordinates) > 1 else ''}
+
+def run_system_command(args):
+    """
+    Run an external command, capturing its output, and kill it after COMMAND_TIMEOUT
+    or when its action times out or is cancelled
+    """
+    commands = getattr(action_context, 'commands', None)
+    start = commands.start if commands is not None else subprocess.Popen
+    # In a session of its own, so a kill also reaches children that would keep the pipes open
+    process = start(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True,
+                    start_new_session=os.name == 'posix')
+    try:
+        stdout, stderr = process.communicate(timeout=COMMAND_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        kill_command(process)
+        try:
+            process.communicate(timeout=1)
+        except subprocess.TimeoutExpired:
+            # Something that left the process group still holds the pipes
+            process.stdout.close()
+            process.stderr.close()
+        raise
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+def kill_command(process):
+    """
+    Kill a command started by run_system_command together with the children it started
     """
-    ssid = wifi_info["SSID"]
-    password = wifi_info["Password"]
-    system_os = platform.system()
     try:
-        if system_os == "Windows":
-            # Windows Wi-Fi connection code
-            profile = f"""
-            <WLANProfile xmlns="http://www.microsoft.com/networking/WLAN/profile/v1">
-                <name>{ssid}</name>
-                <SSIDConfig>
-                    <SSID>
-                        <name>{ssid}</name>
-                    </SSID>
-                </SSIDConfig>
-                <connectionType>ESS</connectionType>
-                <connectionMode>auto</connectionMode>
-                <MSM>
-                    <security>
-                        <authEncryption>
-                            <authentication>WPA2PSK</authentication>
-                            <encryption>AES</encryption>
-                            <useOneX>false</useOneX>
-                        </authEncryption>
-                        <sharedKey>
-                            <keyType>passPhrase</keyType>
-                            <protected>false</protected>
-                            <keyMaterial>{password}</keyMaterial>
-                        </sharedKey>
-                    </security>
-                </MSM>
-            </WLANProfile>
-            """
-            profile_path = "wifi_profile.xml"
-            with open(profile_path, "w") as file:
-                file.write(profile)
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass  # Already gone
+
+def launch_system_command(args):
+    """
+    Start an opener such as xdg-open without waiting for it or the application it launches
+    """
+    return subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                            stderr=subprocess.DEVNULL, start_new_session=os.name == 'posix')
+
+def write_temp_file(data, suffix, directory=None):
+    """
+    Write data to a new file in directory, or the temporary directory, so concurrent actions never share a file
+    """
+    with tempfile.NamedTemporaryFile('w', suffix=suffix, prefix='qr-', dir=directory, delete=False,
+                                     encoding='utf-8') as file:
+        file.write(data)
+    return file.name
+
+class PlatformActions:
+    """
+    Operating system specific part of the actions, used as is where the system is unsupported.
+    Commands whose output is read go through run_command, openers through launch; tests and
+    benchmarks can replace both. Files for openers go to temp_dir, or to a directory of our own
+    that cleanup() removes.
+    """
+    def __init__(self, run_command=None, launch=None, temp_dir=None):
+        self.run_command = run_command or run_system_command
+        self.launch = launch or launch_system_command
+        self.temp_dir = temp_dir
+        self._own_temp_dir = None
+        self._lock = threading.Lock()
+
+    def write_temp_file(self, data, suffix):
+        directory = self.temp_dir
+        if directory is None:
+            with self._lock:
+                if self._own_temp_dir is None:
+                    self._own_temp_dir = tempfile.mkdtemp(prefix='qr-actions-')
+            directory = self._own_temp_dir
+        return write_temp_file(data, suffix, directory)
+
+    def cleanup(self):
+        """
+        Remove the files handed to openers, by now the applications have read them
+        """
+        if self._own_temp_dir is not None:
+            shutil.rmtree(self._own_temp_dir, ignore_errors=True)
+            self._own_temp_dir = None
+
+    def probe(self):
+        """
+        Look up whatever the actions need from the system ahead of the first action
+        """
+        pass
+
+    def invalidate(self):
+        """
+        Forget the probed values, they are looked up again on next use
+        """
+        pass
+
+    def connect_to_wifi(self, ssid, password):
+        print("Unsupported operating system")
+        return False
+
+    def open_file(self, path):
+        print("Unsupported operating system")
+        return False
+
+class WindowsActions(PlatformActions):
+    def connect_to_wifi(self, ssid, password):
+        profile = f"""
+        <WLANProfile xmlns="http://www.microsoft.com/networking/WLAN/profile/v1">
+            <name>{ssid}</name>
+            <SSIDConfig>
+                <SSID>
+                    <name>{ssid}</name>
+                </SSID>
+            </SSIDConfig>
+            <connectionType>ESS</connectionType>
+            <connectionMode>auto</connectionMode>
+            <MSM>
+                <security>
+                    <authEncryption>
+                        <authentication>WPA2PSK</authentication>
+                        <encryption>AES</encryption>
+                        <useOneX>false</useOneX>
+                    </authEncryption>
+                    <sharedKey>
+                        <keyType>passPhrase</keyType>
+                        <protected>false</protected>
+                        <keyMaterial>{password}</keyMaterial>
+                    </sharedKey>
+                </security>
+            </MSM>
+        </WLANProfile>
+        """
+        profile_path = self.write_temp_file(profile, '.xml')
+        try:
             # Add profile and connect
-            subprocess.run(["netsh", "wlan", "add", "profile", f"filename={profile_path}"], check=True, capture_output=True)
-            subprocess.run(["netsh", "wlan", "connect", f"name={ssid}"], check=True, capture_output=True)
+            for args in (["netsh", "wlan", "add", "profile", f"filename={profile_path}"],
+                         ["netsh", "wlan", "connect", f"name={ssid}"]):
+                result = self.run_command(args)
+                if result.returncode != 0:
+                    print(f"Error connecting to Wi-Fi: {result.stderr}")
+                    return False
+        finally:
             os.remove(profile_path)
-            return True
-        elif system_os == "Darwin":
-            # macOS Wi-Fi connection code
-            interface = get_mac_wifi_interface()
-            if not interface:
-                print("Wi-Fi interface not found")
-                return False
-            result = subprocess.run(
-                ["networksetup", "-setairportnetwork", interface, ssid, password],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return True
-            else:
-                print(f"Error connecting to Wi-Fi: {result.stderr}")
-                return False
-        elif system_os == "Linux":
-            # Linux Wi-Fi connection code
-            result = subprocess.run(
-                ["nmcli", "dev", "wifi", "connect", ssid, "password", password],
-                capture_output=True,
-                text=True
-            )
-            if result.returncode == 0:
-                return True
-            else:
-                print(f"Error connecting to Wi-Fi: {result.stderr}")
-                return False
-        else:
-            print("Unsupported operating system")
+        return True
+
+    def open_file(self, path):
+        os.startfile(path)
+        return True
+
+class MacActions(PlatformActions):
+    def __init__(self, run_command=None, launch=None, temp_dir=None):
+        super().__init__(run_command, launch, temp_dir)
+        self._wifi_interface = None
+
+    def probe(self):
+        self.wifi_interface()
+
+    def invalidate(self):
+        self._wifi_interface = None
+
+    def wifi_interface(self):
+        """
+        Wi-Fi interface name, found once and kept until invalidated
+        """
+        if self._wifi_interface is None:
+            self._wifi_interface = self.find_wifi_interface()
+        return self._wifi_interface
+
+    def find_wifi_interface(self):
+        try:
+            result = self.run_command(["networksetup", "-listallhardwareports"])
+            interfaces = result.stdout.split('\n')
+            for i in range(len(interfaces)):
+                if 'Wi-Fi' in interfaces[i] or 'AirPort' in interfaces[i]:
+                    for j in range(i+1, len(interfaces)):
+                        if 'Device: ' in interfaces[j]:
+                            return interfaces[j].split('Device: ')[1]
+            return None
+        except Exception as e:
+            print(f"Error finding Wi-Fi interface: {e}")
+            return None
+
+    def connect_to_wifi(self, ssid, password):
+        interface = self.wifi_interface()
+        if not interface:
+            print("Wi-Fi interface not found")
             return False
-    except subprocess.CalledProcessError as e:
-        print(f"Error connecting to Wi-Fi: {e}")
+        result = self.run_command(["networksetup", "-setairportnetwork", interface, ssid, password])
+        if result.returncode == 0:
+            return True
+        print(f"Error connecting to Wi-Fi: {result.stderr}")
+        # The adapter may have been swapped, so look it up again next time
+        self.invalidate()
+        return False
+
+    def open_file(self, path):
+        self.launch(["open", path])
+        return True
+
+class LinuxActions(PlatformActions):
+    def __init__(self, run_command=None, launch=None, temp_dir=None, nmcli='nmcli', opener='xdg-open'):
+        super().__init__(run_command, launch, temp_dir)
+        self.nmcli = nmcli
+        self.opener = opener
+
+    def connect_to_wifi(self, ssid, password):
+        result = self.run_command([self.nmcli, "dev", "wifi", "connect", ssid, "password", password])
+        if result.returncode == 0:
+            return True
+        print(f"Error connecting to Wi-Fi: {result.stderr}")
         return False
 
-def get_mac_wifi_interface():
+    def open_file(self, path):
+        self.launch([self.opener, path])
+        return True
+
+PLATFORM_ACTIONS = {
+    'Windows': WindowsActions,
+    'Darwin': MacActions,
+    'Linux': LinuxActions,
+}
+
+def create_platform_actions(system=None, run_command=None, launch=None, temp_dir=None):
+    """
+    Action handlers for this operating system, or the given one
+    """
+    return PLATFORM_ACTIONS.get(system or platform.system(), PlatformActions)(run_command, launch, temp_dir)
+
+def connect_to_wifi(wifi_info, platform_actions):
     """
-    Find the Wi-Fi interface name on macOS
+    Connect to Wi-Fi network
     """
     try:
-        result = subprocess.run(
-            ["networksetup", "-listallhardwareports"],
-            capture_output=True,
-            text=True
-        )
-        output = result.stdout
-        interfaces = output.split('\n')
-        for i in range(len(interfaces)):
-            if 'Wi-Fi' in interfaces[i] or 'AirPort' in interfaces[i]:
-                for j in range(i+1, len(interfaces)):
-                    if 'Device: ' in interfaces[j]:
-                        interface = interfaces[j].split('Device: ')[1]
-                        return interface
-        return None
-    except Exception as e:
-        print(f"Error finding Wi-Fi interface: {e}")
-        return None
+        return platform_actions.connect_to_wifi(wifi_info["SSID"], wifi_info["Password"])
+    except (subprocess.SubprocessError, OSError) as e:
+        print(f"Error connecting to Wi-Fi: {e}")
+        return False
 
-def save_contact(contact_data):
+def save_contact(contact_data, platform_actions):
     """
     Save contact information
     """
     try:
-        system_os = platform.system()
-        if system_os == "Windows":
-            temp_dir = tempfile.gettempdir()
-            contact_file = os.path.join(temp_dir, "contact.vcf")
-            with open(contact_file, "w", encoding="utf-8") as file:
-                file.write(contact_data)
-            os.startfile(contact_file)
-            return True
-        elif system_os == "Darwin":
-            contact_file = "/tmp/contact.vcf"
-            with open(contact_file, "w", encoding="utf-8") as file:
-                file.write(contact_data)
-            subprocess.run(["open", contact_file])
-            return True
-        elif system_os == "Linux":
-            contact_file = "/tmp/contact.vcf"
-            with open(contact_file, "w", encoding="utf-8") as file:
-                file.write(contact_data)
-            subprocess.run(["xdg-open", contact_file])
-            return True
-        else:
-            print("Unsupported operating system")
-            return False
+        return platform_actions.open_file(platform_actions.write_temp_file(contact_data, '.vcf'))
     except Exception as e:
         print(f"Error saving contact: {e}")
         return False
 
-def save_event(event_data):
+def save_event(event_data, platform_actions):
     """
     Save event to calendar
     """
     try:
-        system_os = platform.system()
-        if system_os == "Windows":
-            temp_dir = tempfile.gettempdir()
-            event_file = os.path.join(temp_dir, "event.ics")
-            with open(event_file, "w", encoding="utf-8") as file:
-                file.write(event_data)
-            os.startfile(event_file)
-            return True
-        elif system_os == "Darwin":
-            event_file = "/tmp/event.ics"
-            with open(event_file, "w", encoding="utf-8") as file:
-                file.write(event_data)
-            subprocess.run(["open", event_file])
-            return True
-        elif system_os == "Linux":
-            event_file = "/tmp/event.ics"
-            with open(event_file, "w", encoding="utf-8") as file:
-                file.write(event_data)
-            subprocess.run(["xdg-open", event_file])
-            return True
-        else:
-            print("Unsupported operating system")
-            return False
+        return platform_actions.open_file(platform_actions.write_temp_file(event_data, '.ics'))
     except Exception as e:
         print(f"Error saving event: {e}")
         return False
@@ -495,6 +3280,7 @@ def send_email(email_data):
     """
     Send an email
     """
+    import webbrowser
     try:
         email_url = email_data  # Example: mailto:example@example.com?subject=Hello
         webbrowser.open(email_url)
@@ -509,10 +3295,9 @@ def send_sms(sms_data):
     """
     try:
         # Example: smsto:+1234567890:Your message
-        sms_data = sms_data.replace("smsto:", "")
-        parts = sms_data.split(':', 1)
-        phone_number = parts[0]
-        message = parts[1] if len(parts) > 1 else ''
+        sms_info = parse_sms_info(sms_data)
+        phone_number = sms_info["Number"]
+        message = sms_info["Message"]
         # Note: Sending SMS is platform-dependent and may require additional implementation.
         print(f"Sending SMS to {phone_number} with message: {message}")
         return True
@@ -524,12 +3309,12 @@ def open_in_map(geo_data):
     """
     Open location in map
     """
+    import webbrowser
     try:
         # Example: geo:37.7749,-122.4194
-        geo_data = geo_data.replace("geo:", "")
-        coordinates = geo_data.split(',')
-        latitude = coordinates[0]
-        longitude = coordinates[1] if len(coordinates) > 1 else ''
+        geo_info = parse_geo_info(geo_data)
+        latitude = geo_info["Latitude"]
+        longitude = geo_info["Longitude"]
         map_url = f"https://www.google.com/maps/search/?api=1&query={latitude},{longitude}"
         webbrowser.open(map_url)
         return True
@@ -537,15 +3322,106 @@ def open_in_map(geo_data):
         print(f"Error opening map: {e}")
         return False
 
+SOCIAL_DOMAINS = ('instagram.com', 'twitter.com', 'facebook.com', 'linkedin.com', 'tiktok.com')
+
 def is_social_media_link(url):
     """
     Check if the URL is a social media profile link
     """
-    social_domains = ['instagram.com', 'twitter.com', 'facebook.com', 'linkedin.com', 'tiktok.com']
-    for domain in social_domains:
-        if domain in url:
-            return True
-    return False
+    if ' ' in url:
+        return False
+    # Links without a scheme, like instagram.com/name, are parsed as a bare host
+    try:
+        host = urlsplit(url if '://' in url else '//' + url).hostname
+    except ValueError:
+        return False
+    if not host:
+        return False
+    return any(host == domain or host.endswith('.' + domain) for domain in SOCIAL_DOMAINS)
+
+# Action button shown for each payload type
+PAYLOAD_BUTTONS = {
+    'wifi': 'Connect to Wi-Fi',
+    'contact': 'Save Contact',
+    'event': 'Save Event',
+    'email': 'Send Email',
+    'sms': 'Send SMS',
+    'geo': 'Open Map',
+    'social': 'Open Profile',
+    'link': 'Go to Link',
+    'text': 'Copy Text',
+}
+
+PAYLOAD_DESCRIPTIONS = {
+    'contact': "Contact Information Detected",
+    'event': "Event Information Detected",
+    'email': "Email Address Detected",
+    'sms': "SMS Information Detected",
+    'geo': "Geolocation Detected",
+    'social': "Social Media Profile Detected",
+}
+
+# Immutable result of payload parsing, shared between frames through the parse cache
+ParsedPayload = namedtuple('ParsedPayload', ['type', 'data', 'fields'])
+
+def parse_wifi_fields(qr_data):
+    return parse_wifi_info(qr_data) or {"SSID": "", "Password": "", "Type": "", "Hidden": False}
+
+# Prefix matched payload types, in order: type, data prefix, fields parser
+PAYLOAD_TYPES = (
+    ('wifi', 'WIFI:', parse_wifi_fields),
+    ('contact', 'BEGIN:VCARD', parse_vcard_fields),
+    ('event', 'BEGIN:VEVENT', parse_vcard_fields),
+    ('email', 'mailto:', parse_email_info),
+    ('sms', 'smsto:', parse_sms_info),
+    ('geo', 'geo:', parse_geo_info),
+)
+# All prefixes in one pattern; the name of the matching group is the payload type
+PAYLOAD_PREFIX_PATTERN = re.compile(
+    '|'.join(f'(?P<{name}>{re.escape(prefix)})' for name, prefix, _ in PAYLOAD_TYPES))
+PAYLOAD_FIELD_PARSERS = {name: parse_fields for name, _, parse_fields in PAYLOAD_TYPES}
+LINK_PATTERN = re.compile(r'https?://')
+
+def classify_payload(qr_data):
+    """
+    Determine the payload type of QR code data
+    """
+    match = PAYLOAD_PREFIX_PATTERN.match(qr_data)
+    if match:
+        return match.lastgroup
+    elif is_social_media_link(qr_data):
+        return 'social'
+    elif LINK_PATTERN.match(qr_data):
+        return 'link'
+    return 'text'
+
+def parse_payload(qr_data):
+    """
+    Classify QR code data and extract its fields
+    """
+    payload_type = classify_payload(qr_data)
+    parse_fields = PAYLOAD_FIELD_PARSERS.get(payload_type)
+    fields = parse_fields(qr_data) if parse_fields else {}
+    return ParsedPayload(payload_type, qr_data, MappingProxyType(fields))
+
+@lru_cache(maxsize=1024)
+def parse_qr_data(data):
+    """
+    Parsed payload of raw QR code bytes, cached so a code seen again costs a dictionary lookup
+    """
+    return parse_payload(data.decode('utf-8', errors='replace'))
+
+def describe_payload(payload):
+    """
+    Status line shown for a parsed payload
+    """
+    if payload.type == 'wifi':
+        return f"SSID: {payload.fields['SSID']}"
+    elif payload.type == 'link':
+        return f"Link: {payload.data}"
+    elif payload.type == 'text':
+        return f"Text: {payload.data}"
+    return PAYLOAD_DESCRIPTIONS[payload.type]
 
 if __name__ == "__main__":
     main()